@@ -149,12 +149,54 @@ ROLLBAR = {
     'enabled': bool(env.str('ROLLBAR_TOKEN', default='')),
     'locals': {
         'enabled': True,
-        'safe_repr': False,  # enable repr(obj)
+        'safe_repr': True,  # repr() of Django objects may be huge or hit the database
+        'sizes': {
+            'maxlevel': 3,
+            'maxdict': 10,
+            'maxlist': 10,
+            'maxtuple': 10,
+            'maxset': 10,
+            'maxfrozenset': 10,
+            'maxdeque': 10,
+            'maxarray': 10,
+            'maxstring': 200,
+            'maxlong': 40,
+            'maxother': 200,
+        },
     }
 }
 rollbar.init(**ROLLBAR)
+ROLLBAR_QUEUE_SIZE = env.int('ROLLBAR_QUEUE_SIZE', 100)
+ROLLBAR_REPEAT_WINDOW = env.int('ROLLBAR_REPEAT_WINDOW', 60)  # seconds
 
 TELEGRAM_ACCESS_TOKEN = env.str('TELEGRAM_ACCESS_TOKEN')
+TELEGRAM_BASE_URL = env.str('TELEGRAM_BASE_URL', None)  # e.g. a local fake Bot API: http://127.0.0.1:8081/bot
+TELEGRAM_WEBHOOK_SECRET = env.str('TELEGRAM_WEBHOOK_SECRET', '')
+TELEGRAM_UPDATE_QUEUE_SIZE = env.int('TELEGRAM_UPDATE_QUEUE_SIZE', 1000)
+TELEGRAM_DISPATCHER_LANES = env.int('TELEGRAM_DISPATCHER_LANES', 4)
+TELEGRAM_SEND_RATE = env.float('TELEGRAM_SEND_RATE', 30)  # messages per second for the whole bot
+TELEGRAM_CHAT_SEND_RATE = env.float('TELEGRAM_CHAT_SEND_RATE', 1)  # messages per second for one chat
+TELEGRAM_CHAT_SEND_BURST = env.int('TELEGRAM_CHAT_SEND_BURST', 3)
+TELEGRAM_SEND_WORKERS = env.int('TELEGRAM_SEND_WORKERS', 8)
+
+PLAYER_SESSION_CACHE_SIZE = env.int('PLAYER_SESSION_CACHE_SIZE', 20000)
+PLAYER_SESSION_CACHE_TTL = env.int('PLAYER_SESSION_CACHE_TTL', 300)  # seconds
+PLAYER_SESSION_SYNC_INTERVAL = env.int('PLAYER_SESSION_SYNC_INTERVAL', 5)  # seconds
+UPDATE_QUERY_BUDGET = env.int('UPDATE_QUERY_BUDGET', 10)
+
+REBUS_CATALOG_TTL = env.int('REBUS_CATALOG_TTL', 60)  # seconds
+
+WRITE_BUFFER_BATCH_SIZE = env.int('WRITE_BUFFER_BATCH_SIZE', 500)
+WRITE_BUFFER_FLUSH_INTERVAL = env.float('WRITE_BUFFER_FLUSH_INTERVAL', 1)  # seconds
+
+NOTIFICATIONS_POLL_INTERVAL = env.int('NOTIFICATIONS_POLL_INTERVAL', 5)  # seconds
+NOTIFICATIONS_BATCH_SIZE = env.int('NOTIFICATIONS_BATCH_SIZE', 500)
+
+EXPORT_WORKERS = env.int('EXPORT_WORKERS', 2)
+
+MAX_PUZZLES_TO_WIN = env.int('MAX_PUZZLES_TO_WIN', 10)
+
+POLL_QUESTIONS_FILE = env.str('POLL_QUESTIONS_FILE', os.path.join(BASE_DIR, 'questions_to_clients.txt'))
 
 ADMIN_SHORTCUTS = [
     {
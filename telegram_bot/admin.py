@@ -1,19 +1,31 @@
+import tablib
+from bisect import bisect_right
+
 from django import forms
-from django.urls import reverse
+from django.urls import path, reverse
 from django.contrib import admin
+from django.core.exceptions import PermissionDenied
+from django.db.models import Count, Max
+from django.shortcuts import get_object_or_404, redirect
 from django.utils.html import format_html
 from django.utils.safestring import mark_safe
-from django.utils.timezone import now
+from django.utils.http import urlencode
+from django.utils.timezone import localdate, now
 
 from import_export import resources
 from import_export.fields import Field
 from import_export.admin import ImportExportModelAdmin
+from import_export.forms import ExportForm
 
 from .models import (
     Player, Draw,
     Rebus, RebusAttempt, Answer,
-    PollResult, PollQuestionAnswerPair
+    PollResult, PollQuestionAnswerPair,
+    ExportArtifact,
 )
+from .exports import Export, export_jobs, get_artifact_response
+from .admin_pagination import CURSOR_VAR, KeysetPaginationMixin
+from .rebus_answers import is_right_answer, normalize_right_answers
 
 
 class PlayerResources(resources.ModelResource):
@@ -24,11 +36,46 @@ class PlayerResources(resources.ModelResource):
         model = Player
         fields = ('full_name', 'phone_number')
 
+    def filter_exported(self, queryset):
+        return queryset.filter(exclude_from_export=False)
+
     def export(self, queryset=None, *args, **kwargs):
-        queryset = queryset.filter(exclude_from_export=False)
+        queryset = self.filter_exported(queryset)
         return super(PlayerResources, self).export(queryset, *args, **kwargs)
 
 
+class PlayerExport(Export):
+    kind = 'players'
+
+    def __init__(self, resource, queryset, file_format, params):
+        super().__init__(params)
+        self.resource = resource
+        self.changelist_queryset = queryset
+        self.queryset = resource.filter_exported(queryset)
+        self.file_format = file_format
+
+    def get_watermark(self):
+        # excluded players count too, otherwise excluding one of them goes unnoticed
+        players = self.changelist_queryset.aggregate(
+            count=Count('id'), last_id=Max('id'), last_updated_at=Max('updated_at'),
+        )
+        return f'{players["count"]}:{players["last_id"]}:{players["last_updated_at"]}'
+
+    def count_rows(self):
+        return self.queryset.count()
+
+    def get_filename(self, version):
+        return f'Player-{localdate()}-{version}.{self.file_format.get_extension()}'
+
+    def write(self, output, report_progress):
+        dataset = tablib.Dataset(headers=self.resource.get_export_headers())
+        for rows_done, player in enumerate(self.queryset.iterator(), 1):
+            dataset.append(self.resource.export_resource(player))
+            report_progress(rows_done)
+        data = self.file_format.export_data(dataset)
+        output.write(data.encode() if isinstance(data, str) else data)
+
+
 class DrawFilter(admin.SimpleListFilter):
     title = 'Розыгрыши'
     parameter_name = 'draw'
@@ -50,6 +97,18 @@ class DrawFilter(admin.SimpleListFilter):
             return queryset.filter(end_at__lte=time)
 
 
+class DrawWinnersFilter(admin.SimpleListFilter):
+    title = 'Отгадали все ребусы в розыгрыше'
+    parameter_name = 'draw'
+
+    def lookups(self, request, model_admin):
+        return Draw.objects.order_by('-end_at').values_list('id', 'title')
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.winners_of(self.value())
+
+
 class AnswerInline(admin.TabularInline):
     model = Answer
     extra = 0
@@ -61,18 +120,22 @@ class PollQuestionAnswerPairInline(admin.TabularInline):
     extra = 0
     readonly_fields = [
         'poll',
-        'slug',
         'question',
         'answer',
         'asked_at',
         'answered_at',
     ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('question')
+
 
 @admin.register(Player)
-class PlayerAdmin(ImportExportModelAdmin):
+class PlayerAdmin(KeysetPaginationMixin, ImportExportModelAdmin):
+    keyset_field = 'created_at'
     resource_class = PlayerResources
     search_fields = ['full_name', 'telegram_id']
+    list_filter = [DrawWinnersFilter]
     list_editable = ['gift_received']
     readonly_fields = ['telegram_id', 'created_at', 'bot_state']
     list_display = [
@@ -90,6 +153,50 @@ class PlayerAdmin(ImportExportModelAdmin):
         'exclude_from_export',
     ]
 
+    def save_model(self, request, obj, form, change):
+        if change:
+            # the bot keeps its own fields of the player, write only what the admin changed
+            if form.changed_data:
+                obj.save(update_fields=[*form.changed_data, 'updated_at'])
+        else:
+            obj.save()
+
+    def get_urls(self):
+        return [
+            path(
+                'export/<int:artifact_id>/',
+                self.admin_site.admin_view(self.export_artifact_view),
+                name='telegram_bot_player_export_artifact',
+            ),
+        ] + super().get_urls()
+
+    def export_action(self, request, *args, **kwargs):
+        # the export is built in the background, the admin waits for it on the artifact page
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        formats = self.get_export_formats()
+        form = ExportForm(formats, request.POST or None)
+        if not form.is_valid():
+            return super().export_action(request, *args, **kwargs)
+        file_format = formats[int(form.cleaned_data['file_format'])]()
+        export = PlayerExport(
+            self.get_export_resource_class()(**self.get_export_resource_kwargs(request)),
+            self.get_export_queryset(request),
+            file_format,
+            params=urlencode(sorted([
+                ('format', file_format.get_extension()),
+                *((key, value) for key, value in request.GET.items() if key != CURSOR_VAR),
+            ])),
+        )
+        artifact = export_jobs.request(export)
+        return redirect('admin:telegram_bot_player_export_artifact', artifact.id)
+
+    def export_artifact_view(self, request, artifact_id):
+        if not self.has_export_permission(request):
+            raise PermissionDenied
+        artifact = get_object_or_404(ExportArtifact, pk=artifact_id, kind=PlayerExport.kind)
+        return get_artifact_response(request, artifact)
+
 
 class DrawForm(forms.ModelForm):
 
@@ -120,6 +227,9 @@ class DrawAdmin(admin.ModelAdmin):
                     'get_status_draw',
                     ]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_winners_count()
+
     def get_status_draw(self, obj):
         states_colors = {
             'текущий': 'green',
@@ -142,16 +252,15 @@ class DrawAdmin(admin.ModelAdmin):
                 '''<a href="{}?draw={}" style="background-color: #4CAF50;border: none;
                 color: white;padding: 8px 18px;text-align: center;text-decoration: none;
                 f'display: inline-block;font-size: 16px;margin: 4px 2px;cursor: pointer;">Скачать</a>
-                ''', url, obj.title
+                ''', url, obj.id
             )
             return mark_safe(download_button_html)
     get_download_link.short_description = 'Данные о розыгрыше'
 
     def get_amount_users(self, obj):
-        # TODO переписать без использования поля Player.draw
-        return 0  # FIXME загулшка
-        # return Player.objects.filter(draw__title=obj.title).count()
+        return obj.winners_count
     get_amount_users.short_description = 'Количество участников'
+    get_amount_users.admin_order_field = 'winners_count'
 
 
 @admin.register(Rebus)
@@ -173,7 +282,8 @@ class RebusAdmin(admin.ModelAdmin):
     def get_preview_image(self, obj):
         if not obj.image:
             return '-'
-        return mark_safe(f'<img src="{obj.image.url}" height="{130}" />')
+        image = obj.thumbnail or obj.image
+        return mark_safe(f'<img src="{image.url}" height="{130}" />')
     get_preview_image.short_description = 'Предварительный просмотр изображения'
 
     def get_edit_url(self, obj):
@@ -191,8 +301,25 @@ class RebusAdmin(admin.ModelAdmin):
     get_rebus_answers.short_description = 'Ответы'
 
 
+class DrawIntervals:
+    # Draws don't overlap, so the draw of an attempt is the last one started before
+    # the answer, if it hasn't ended before the rebus was sent.
+    def __init__(self, draws):
+        self.draws = sorted(draws, key=lambda draw: draw.start_at)
+        self.starts = [draw.start_at for draw in self.draws]
+
+    def find(self, start_at, end_at):
+        if start_at is None or end_at is None:
+            return None
+        index = bisect_right(self.starts, start_at)
+        if index and self.draws[index - 1].end_at >= end_at:
+            return self.draws[index - 1]
+        return None
+
+
 @admin.register(RebusAttempt)
-class RebusAttemptAdmin(admin.ModelAdmin):
+class RebusAttemptAdmin(KeysetPaginationMixin, admin.ModelAdmin):
+    keyset_field = 'answer_received_at'
     list_filter = ['success']
     list_display = [
         'rebus',
@@ -216,25 +343,20 @@ class RebusAttemptAdmin(admin.ModelAdmin):
         return []
 
     def get_right_answers(self, obj):
-        rebus_answers = obj.rebus.answers.values('answer')
-        answers = [answer['answer'] for answer in rebus_answers]
-        return answers
+        return [answer.answer for answer in obj.rebus.answers.all()]
     get_right_answers.short_description = 'Правильные ответы'
 
     def get_check_answer(self, obj):
-        query_set_right_answers = obj.rebus.answers.all()
-        right_answers = [answer.answer for answer in query_set_right_answers]
-        if obj.answer in right_answers:
+        right_answers = normalize_right_answers(answer.answer for answer in obj.rebus.answers.all())
+        if is_right_answer(obj.answer, right_answers):
             return mark_safe(f'<span style="color:green;font-weight:bold">{obj.answer}</span>')
         return mark_safe(f'<span style="color:red;font-weight:bold">{obj.answer}</span>')
     get_check_answer.short_description = 'Ответ участника'
 
     def get_draw(self, obj):
-        start_at = obj.answer_received_at
-        end_at = obj.rebus_sendet_at
-        draws = Draw.objects.filter(start_at__lte=start_at, end_at__gte=end_at).first()
-        if draws:
-            return draws.title
+        draw = getattr(obj, 'draw', None)
+        if draw:
+            return draw.title
         return '-'
     get_draw.short_description = 'Розыгрыш'
 
@@ -242,6 +364,14 @@ class RebusAttemptAdmin(admin.ModelAdmin):
         queryset = super().get_queryset(request)
         return queryset.select_related('rebus', 'user').prefetch_related('rebus__answers')
 
+    def get_changelist_instance(self, request):
+        # the page of attempts is fetched here and reused by the template
+        changelist = super().get_changelist_instance(request)
+        draw_intervals = DrawIntervals(Draw.objects.only('title', 'start_at', 'end_at'))
+        for attempt in changelist.result_list:
+            attempt.draw = draw_intervals.find(attempt.answer_received_at, attempt.rebus_sendet_at)
+        return changelist
+
 
 @admin.register(PollResult)
 class PollResultAdmin(admin.ModelAdmin):
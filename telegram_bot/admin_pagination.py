@@ -0,0 +1,125 @@
+import json
+
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ORDER_VAR, PAGE_VAR, ChangeList
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+CURSOR_VAR = 'after'
+
+
+def estimate_count(queryset):
+    # the number of rows the PostgreSQL planner expects, None on other databases
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        return None
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+class EstimatedCountPaginator(Paginator):
+    exact_count_limit = 10000
+
+    def __init__(self, *args, exact_count_limit=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.exact_count_limit = exact_count_limit or self.exact_count_limit
+        self.count_is_estimated = False
+
+    @cached_property
+    def count(self):
+        estimate = estimate_count(self.object_list)
+        if estimate is None or estimate < self.exact_count_limit:
+            return self.object_list.count()
+        self.count_is_estimated = True
+        return estimate
+
+
+class KeysetChangeList(ChangeList):
+    # In the default ordering, newest first by the keyset field, the next page is
+    # selected by the keyset field and pk of the last row shown instead of an OFFSET,
+    # so it's read from the index however deep it is. Other orderings and page
+    # numbers are paginated as usual.
+    def get_filters_params(self, params=None):
+        lookup_params = super().get_filters_params(params)
+        lookup_params.pop(CURSOR_VAR, None)
+        return lookup_params
+
+    def get_query_string(self, new_params=None, remove=None):
+        # sorting, filters and search start from the first page
+        return super().get_query_string(new_params, [CURSOR_VAR, *(remove or [])])
+
+    @property
+    def keyset_field(self):
+        return self.model_admin.keyset_field
+
+    @property
+    def uses_keyset(self):
+        return ORDER_VAR not in self.params and not self.show_all
+
+    def get_results(self, request):
+        super().get_results(request)
+        cursor = self.params.get(CURSOR_VAR)
+        if cursor and self.uses_keyset:
+            self.result_list = self.queryset.filter(self.get_rows_after(cursor))[:self.list_per_page]
+
+    def get_rows_after(self, cursor):
+        value, _, pk = cursor.rpartition('|')
+        try:
+            value = self.lookup_opts.get_field(self.keyset_field).to_python(value or None)
+            pk = self.lookup_opts.pk.to_python(pk)
+        except (ValidationError, ValueError):
+            raise IncorrectLookupParameters
+        # rows without a value come first in the descending order if NULL is the largest value
+        nulls_first = connections[self.queryset.db].features.nulls_order_largest
+        field = self.keyset_field
+        if value is None:
+            rows_after = Q(**{f'{field}__isnull': True, 'pk__lt': pk})
+            if nulls_first:
+                rows_after |= Q(**{f'{field}__isnull': False})
+            return rows_after
+        # the redundant upper bound lets the database read the rows from the index
+        rows_after = Q(**{f'{field}__lte': value}) & (Q(**{f'{field}__lt': value}) | Q(pk__lt=pk))
+        if not nulls_first:
+            rows_after |= Q(**{f'{field}__isnull': True})
+        return rows_after
+
+    def get_first_page_url(self):
+        if CURSOR_VAR in self.params or self.page_num:
+            return self.get_query_string({PAGE_VAR: None})
+        return None
+
+    def get_next_page_url(self):
+        if not self.multi_page or len(self.result_list) < self.list_per_page:
+            return None
+        last_row = self.result_list[len(self.result_list) - 1]
+        value = getattr(last_row, self.keyset_field)
+        cursor = f'{"" if value is None else value.isoformat()}|{last_row.pk}'
+        return self.get_query_string({CURSOR_VAR: cursor, PAGE_VAR: None})
+
+
+class KeysetPaginationMixin:
+    # Changelists of tables with millions of rows: counts come from the planner
+    # estimate once it's over exact_count_limit, pages go by the keyset field.
+    keyset_field = None
+    exact_count_limit = EstimatedCountPaginator.exact_count_limit
+    show_full_result_count = False
+
+    def get_ordering(self, request):
+        return [f'-{self.keyset_field}', '-pk']
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        return EstimatedCountPaginator(
+            queryset, per_page, orphans, allow_empty_first_page, exact_count_limit=self.exact_count_limit,
+        )
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class TelegramBotConfig(AppConfig):
     name = 'telegram_bot'
+
+    def ready(self):
+        from . import signals  # noqa: F401
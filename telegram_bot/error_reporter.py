@@ -0,0 +1,105 @@
+import sys
+import time
+import queue
+import logging
+import threading
+
+import rollbar
+from django.conf import settings
+
+from . import metrics
+
+
+STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def get_fingerprint(exc_info):
+    exc_type, _, traceback = exc_info
+    while traceback and traceback.tb_next:
+        traceback = traceback.tb_next
+    location = (traceback.tb_frame.f_code.co_filename, traceback.tb_lineno) if traceback else None
+    return exc_type, location
+
+
+class ErrorReporter:
+    # Sends exceptions to Rollbar from a background thread, so building the payload
+    # never slows down a handler. The same exception raised at the same line is sent
+    # once per window with the number of repeats skipped before it. When Rollbar can't
+    # keep up and the queue is full, new reports are dropped.
+    # Until the reporter is started, e.g. in management commands, reports are sent right away.
+    def __init__(self, queue_size=100, window=60):
+        self.window = window
+        self._queue = queue.Queue(queue_size)
+        self._windows = {}  # fingerprint: (window start, repeats skipped)
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        metrics.register_gauge('error_reporter.queue', self._queue.qsize)
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self.send_reports, name='error_reporter', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        with self._lock:
+            self._running = False
+        if self._thread:
+            self._queue.put(STOP)
+            self._thread.join(timeout)
+            self._thread = None
+
+    def report(self, exc_info=None):
+        exc_info = exc_info or sys.exc_info()
+        skipped = self.count_repeat(get_fingerprint(exc_info))
+        if skipped is None:
+            metrics.incr('error_reporter.skipped')
+            return
+        extra_data = {'skipped_repeats': skipped} if skipped else None
+        if not self._running:
+            self.send(exc_info, extra_data)
+            return
+        try:
+            self._queue.put_nowait((exc_info, extra_data))
+        except queue.Full:
+            metrics.incr('error_reporter.dropped')
+
+    def count_repeat(self, fingerprint):
+        # returns None for a repeat within the window, otherwise the repeats skipped before
+        moment = time.monotonic()
+        with self._lock:
+            window_start, skipped = self._windows.get(fingerprint, (None, 0))
+            if window_start is not None and moment - window_start < self.window:
+                self._windows[fingerprint] = (window_start, skipped + 1)
+                return None
+            if len(self._windows) > 1000:
+                self._windows = {
+                    key: value for key, value in self._windows.items() if moment - value[0] < self.window
+                }
+            self._windows[fingerprint] = (moment, 0)
+            return skipped
+
+    def send_reports(self):
+        while True:
+            report = self._queue.get()
+            if report is STOP:
+                break
+            self.send(*report)
+
+    def send(self, exc_info, extra_data):
+        try:
+            rollbar.report_exc_info(exc_info, extra_data=extra_data)
+            metrics.incr('error_reporter.sent')
+        except Exception:
+            logger.exception('Could not report an error to Rollbar')
+
+
+error_reporter = ErrorReporter(
+    queue_size=settings.ROLLBAR_QUEUE_SIZE,
+    window=settings.ROLLBAR_REPEAT_WINDOW,
+)
@@ -0,0 +1,153 @@
+import os
+import abc
+import time
+import hashlib
+import logging
+import datetime
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.http import FileResponse
+from django.template.response import TemplateResponse
+from django.utils.timezone import now
+
+from . import metrics
+from .models import ExportArtifact
+
+
+PROGRESS_INTERVAL = 1  # seconds
+STALE_AFTER = datetime.timedelta(minutes=5)  # a running export not updated for so long has died
+
+logger = logging.getLogger(__name__)
+
+
+class Export(abc.ABC):
+    # One kind of export. The watermark changes whenever rows the export depends on
+    # are added, edited or deleted, so a finished artifact with the same watermark
+    # is still up to date.
+    kind = None
+
+    def __init__(self, params=''):
+        # the params can be as long as the filters of the admin, artifacts are looked up by their hash
+        self.params = params
+        self.params_hash = hashlib.sha256(params.encode()).hexdigest()
+
+    @abc.abstractmethod
+    def get_watermark(self):
+        pass
+
+    def count_rows(self):
+        return None
+
+    @abc.abstractmethod
+    def get_filename(self, version):
+        pass
+
+    @abc.abstractmethod
+    def write(self, output, report_progress):
+        # writes bytes to output and calls report_progress(rows written) as it goes
+        pass
+
+
+class ExportProgress:
+    def __init__(self, artifact_id):
+        self.artifact_id = artifact_id
+        self.rows_done = 0
+        self._reported_at = time.monotonic()
+
+    def __call__(self, rows_done):
+        self.rows_done = rows_done
+        if time.monotonic() - self._reported_at > PROGRESS_INTERVAL:
+            self._reported_at = time.monotonic()
+            ExportArtifact.objects.filter(pk=self.artifact_id).update(rows_done=rows_done, updated_at=now())
+
+
+class ExportJobs:
+    # Exports are built by a small thread pool of the web process, so a request only
+    # starts an export or reports its progress and never runs into the worker timeout.
+    # Artifacts are saved to the default storage, every build gets the next version.
+    # When a web worker is restarted, its unfinished exports die with it and are
+    # started again by the first request after STALE_AFTER.
+    def __init__(self, workers=2):
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix='export')
+
+    def request(self, export):
+        artifacts = ExportArtifact.objects.filter(kind=export.kind, params_hash=export.params_hash).order_by('-version')
+        latest = artifacts.first()
+        # the progress page reloads itself, it doesn't need the watermark
+        if latest and latest.status in (ExportArtifact.PENDING, ExportArtifact.RUNNING) \
+                and now() - latest.updated_at < STALE_AFTER:
+            return latest
+        watermark = export.get_watermark()
+        if latest and latest.status == ExportArtifact.DONE and latest.watermark == watermark:
+            metrics.incr('exports.reused')
+            return latest
+        try:
+            with transaction.atomic():
+                artifact = ExportArtifact.objects.create(
+                    kind=export.kind, params=export.params, params_hash=export.params_hash,
+                    version=latest.version + 1 if latest else 1,
+                    watermark=watermark,
+                )
+        except IntegrityError:
+            # the same export was started by a concurrent request
+            return artifacts.first()
+        self._executor.submit(self.build, export, artifact)
+        return artifact
+
+    def build(self, export, artifact):
+        close_old_connections()
+        started_at = time.monotonic()
+        try:
+            self.write_artifact(export, artifact)
+        except Exception as error:
+            logger.exception('Export %s failed', artifact)
+            metrics.incr('exports.failed')
+            ExportArtifact.objects.filter(pk=artifact.pk).update(
+                status=ExportArtifact.FAILED, error=repr(error), updated_at=now()
+            )
+        else:
+            metrics.observe('exports.build', time.monotonic() - started_at)
+            self.delete_previous_versions(artifact)
+        finally:
+            connection.close()
+
+    def write_artifact(self, export, artifact):
+        ExportArtifact.objects.filter(pk=artifact.pk).update(
+            status=ExportArtifact.RUNNING, rows_total=export.count_rows(), updated_at=now()
+        )
+        report_progress = ExportProgress(artifact.pk)
+        with tempfile.TemporaryFile() as output:
+            export.write(output, report_progress)
+            output.seek(0)
+            artifact.file.save(export.get_filename(artifact.version), File(output), save=False)
+        ExportArtifact.objects.filter(pk=artifact.pk).update(
+            status=ExportArtifact.DONE, file=artifact.file.name,
+            rows_done=report_progress.rows_done, updated_at=now(),
+        )
+
+    def delete_previous_versions(self, artifact):
+        previous_artifacts = ExportArtifact.objects.filter(
+            kind=artifact.kind, params_hash=artifact.params_hash, version__lt=artifact.version,
+        )
+        for previous_artifact in previous_artifacts:
+            if previous_artifact.file:
+                previous_artifact.file.delete(save=False)
+        previous_artifacts.delete()
+
+
+def get_artifact_response(request, artifact):
+    if artifact.status == ExportArtifact.DONE:
+        return FileResponse(
+            artifact.file.open('rb'), as_attachment=True, filename=os.path.basename(artifact.file.name)
+        )
+    return TemplateResponse(request, 'telegram_bot/export_progress.html', {
+        'title': 'Выгрузка',
+        'artifact': artifact,
+    }, status=202)
+
+
+export_jobs = ExportJobs(workers=settings.EXPORT_WORKERS)
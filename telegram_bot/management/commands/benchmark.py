@@ -0,0 +1,140 @@
+import time
+import random
+
+from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils.timezone import now
+
+from telegram_bot.models import Draw, DrawProgress, Player, PollResult, RebusAttempt
+from telegram_bot.rebus_catalog import rebus_catalog
+from telegram_bot.tg_lib import check_answer
+
+
+def benchmark_check_answer(command, iterations):
+    rebus_ids = sorted(rebus_catalog.published_ids())
+    if not rebus_ids:
+        raise CommandError('Нет опубликованных ребусов')
+    guesses = []
+    for rebus_id in rebus_ids:
+        right_answers = sorted(rebus_catalog.get_right_answers(rebus_id))
+        guesses += [(rebus_id, answer.lower()) for answer in right_answers]
+        guesses.append((rebus_id, 'Совсем неправильный ответ, (точно).'))
+    guesses = [random.choice(guesses) for _ in range(iterations)]
+
+    started_at = time.perf_counter()
+    for rebus_id, guess in guesses:
+        check_answer(rebus_id, guess)
+    elapsed = time.perf_counter() - started_at
+
+    command.stdout.write(
+        f'check_answer: {iterations} guesses over {len(rebus_ids)} rebuses in {elapsed:.3f}s, '
+        f'{iterations / elapsed:.0f} guesses/s'
+    )
+
+
+def get_index_checks():
+    # (hot query, its model, columns of the indexes any of which the query must use)
+    moment = now()
+    player = Player(pk=1)
+    draw = Draw(pk=1, start_at=moment, end_at=moment)
+    return [
+        (
+            'Участник по telegram_id',
+            Player.objects.filter(telegram_id=1),
+            Player, [['telegram_id']],
+        ),
+        (
+            'Отгаданные участником ребусы в розыгрыше',
+            RebusAttempt.objects.successful_during(draw).filter(user=player).values_list('rebus_id', flat=True),
+            RebusAttempt, [['user_id', 'rebus_id'], ['answer_received_at']],
+        ),
+        (
+            'Верные ответы за время розыгрыша',
+            RebusAttempt.objects.successful_during(draw),
+            RebusAttempt, [['answer_received_at']],
+        ),
+        (
+            'Незаконченный опрос участника',
+            PollResult.objects.filter(user=player, poll_finished=False),
+            PollResult, [['user_id', 'poll_finished']],
+        ),
+        (
+            'Прогресс участника в текущем розыгрыше',
+            DrawProgress.objects.filter(player=player, draw__start_at__lte=moment, draw__end_at__gte=moment),
+            DrawProgress, [['player_id', 'draw_id']],
+        ),
+        (
+            'Текущий розыгрыш',
+            Draw.objects.get_current_draw(),
+            Draw, [['start_at'], ['end_at']],
+        ),
+    ]
+
+
+def get_index_columns(model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            # indexes of unique constraints are named by sqlite itself, introspection doesn't know them
+            cursor.execute(f'PRAGMA index_list({table})')
+            index_names = [row[1] for row in cursor.fetchall()]
+            index_columns = {}
+            for name in index_names:
+                cursor.execute(f'PRAGMA index_info({name})')
+                index_columns[name] = [row[2] for row in cursor.fetchall()]
+            return index_columns
+        constraints = connection.introspection.get_constraints(cursor, table)
+    return {
+        name: constraint['columns'] for name, constraint in constraints.items()
+        if constraint['index'] or constraint['unique']
+    }
+
+
+def benchmark_explain(command, iterations):
+    missing_indexes = []
+    for title, queryset, model, columns_options in get_index_checks():
+        index_names = [
+            name for name, columns in get_index_columns(model).items()
+            if columns in columns_options
+        ]
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # on a small base the planner prefers to read the whole table,
+                # the check is whether the index can be used at all
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            plan = queryset.explain()
+        used_index_names = [name for name in index_names if name in plan]
+        if used_index_names:
+            command.stdout.write(f'{title}: индекс {used_index_names[0]}')
+        else:
+            missing_indexes.append(title)
+            command.stdout.write(f'{title}: не использует индекс')
+        command.stdout.write(plan)
+    if missing_indexes:
+        raise CommandError(f'Запросы без индекса: {", ".join(missing_indexes)}')
+
+
+BENCHMARKS = {
+    'check_answer': benchmark_check_answer,
+    'explain': benchmark_explain,
+}
+
+
+class Command(BaseCommand):
+    help = 'Замеряет производительность горячих участков бота на данных из базы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'benchmarks', nargs='*',
+            help=f'Какие замеры запустить, по умолчанию все: {", ".join(BENCHMARKS)}',
+        )
+        parser.add_argument('--iterations', type=int, default=100000)
+
+    def handle(self, *args, **options):
+        names = options['benchmarks'] or list(BENCHMARKS)
+        unknown_names = set(names) - set(BENCHMARKS)
+        if unknown_names:
+            raise CommandError(f'Неизвестные замеры: {", ".join(sorted(unknown_names))}')
+        for name in names:
+            BENCHMARKS[name](self, options['iterations'])
@@ -0,0 +1,28 @@
+from django.core.management import BaseCommand
+
+from telegram_bot.models import Rebus
+from telegram_bot.rebus_images import delete_on_commit
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры и изображения для Telegram у ребусов, загруженных раньше'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all', action='store_true',
+            help='пересоздать и у тех ребусов, где они уже есть',
+        )
+
+    def handle(self, *args, **options):
+        rebuses = Rebus.objects.exclude(image='').order_by('id')
+        if not options['all']:
+            rebuses = rebuses.filter(thumbnail='')
+        for rebus in rebuses:
+            rebus.image.open('rb')
+            try:
+                replaced_files = rebus.build_derivatives()
+            finally:
+                rebus.image.close()
+            rebus.save(update_fields=['thumbnail', 'telegram_image'])
+            delete_on_commit(rebus.thumbnail.storage, replaced_files)
+            self.stdout.write(f'{rebus}: {rebus.thumbnail.name}, {rebus.telegram_image.name}')
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from telegram_bot.models import Draw, DrawProgress
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает прогресс участников в розыгрышах по верным ответам на ребусы'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'draw_ids', nargs='*', type=int,
+            help='id розыгрышей, по дефолту все',
+        )
+
+    def handle(self, *args, **options):
+        draws = Draw.objects.order_by('start_at')
+        if options['draw_ids']:
+            draws = draws.filter(pk__in=options['draw_ids'])
+        for draw in draws:
+            with transaction.atomic():
+                DrawProgress.objects.rebuild(draw)
+            self.stdout.write(f'{draw}: {DrawProgress.objects.filter(draw=draw).count()} участников')
@@ -1,7 +1,8 @@
-import rollbar
 from django.conf import settings
 from django.core.management import BaseCommand
 
+from telegram_bot.write_buffer import write_buffer
+from telegram_bot.error_reporter import error_reporter
 from telegram_bot.tg_rebus import (
     TgDialogBot,
     start,
@@ -13,15 +14,26 @@ from telegram_bot.tg_rebus import (
 
 
 class Command(BaseCommand):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--webhook-url',
+            help='Принимать обновления через вебхук по этому адресу вместо long polling',
+        )
+        parser.add_argument('--listen', default='127.0.0.1', help='Адрес для вебхука и /metrics')
+        parser.add_argument(
+            '--port', type=int,
+            help='Порт для вебхука и /metrics, по умолчанию 8443 в режиме вебхука',
+        )
+
     def handle(self, *args, **options):
         try:
-            start_bot()
+            start_bot(options['webhook_url'], options['listen'], options['port'])
         except Exception as exc:
-            rollbar.report_exc_info()
+            error_reporter.report()
             raise
 
 
-def start_bot():
+def start_bot(webhook_url=None, listen='127.0.0.1', port=None):
 
     bot = TgDialogBot(
         settings.TELEGRAM_ACCESS_TOKEN,
@@ -31,7 +43,33 @@ def start_bot():
             'HANDLE_SELECTIONS': handle_select,
             'HANDLE_POLL': handle_poll,
             'HANDLE_REBUS': handle_rebus
-        }
+        },
+        base_url=settings.TELEGRAM_BASE_URL,
+        lanes=settings.TELEGRAM_DISPATCHER_LANES,
+        update_queue_size=settings.TELEGRAM_UPDATE_QUEUE_SIZE,
+        send_rate=settings.TELEGRAM_SEND_RATE,
+        chat_send_rate=settings.TELEGRAM_CHAT_SEND_RATE,
+        chat_send_burst=settings.TELEGRAM_CHAT_SEND_BURST,
+        send_workers=settings.TELEGRAM_SEND_WORKERS,
+        notification_interval=settings.NOTIFICATIONS_POLL_INTERVAL,
+        notification_batch_size=settings.NOTIFICATIONS_BATCH_SIZE,
+        session_sync_interval=settings.PLAYER_SESSION_SYNC_INTERVAL,
     )
-    bot.updater.start_polling()
-    bot.updater.idle()  # required in detached mode on server
+    error_reporter.start()
+    bot.outbox.start()
+    write_buffer.start()
+    try:
+        if webhook_url:
+            bot.updater.start_listener(listen, port or 8443, webhook_url, settings.TELEGRAM_WEBHOOK_SECRET)
+        else:
+            bot.updater.start_polling()
+            if port:
+                bot.updater.start_listener(listen, port)
+        bot.updater.idle()  # required in detached mode on server
+    finally:
+        # also when the bot failed to start: buffered rows are written and no thread keeps the process alive
+        bot.updater.stop()
+        bot.outbox.stop()
+        bot.notifications.delete_sent()
+        write_buffer.stop()
+        error_reporter.stop()
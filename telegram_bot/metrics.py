@@ -0,0 +1,51 @@
+import threading
+from collections import defaultdict
+
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_gauges = {}
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, value):
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0})
+        timing['count'] += 1
+        timing['total'] += value
+        timing['max'] = max(timing['max'], value)
+
+
+def register_gauge(name, func):
+    with _lock:
+        _gauges[name] = func
+
+
+class QueryCounter:
+    # use with django.db.connection.execute_wrapper()
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def snapshot():
+    with _lock:
+        counters = dict(_counters)
+        timings = {
+            name: {**timing, 'avg': timing['total'] / timing['count'] if timing['count'] else 0.0}
+            for name, timing in _timings.items()
+        }
+        gauges = dict(_gauges)
+    return {
+        'counters': counters,
+        'timings': timings,
+        'gauges': {name: func() for name, func in gauges.items()},
+    }
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.2 on 2026-10-18 06:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0033_auto_20201123_1802'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='player',
+            name='draw',
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='rebus_deck',
+            field=models.JSONField(blank=True, default=list, help_text='Перемешанные id ребусов, участник получает их по порядку', verbose_name='Колода ребусов'),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='rebus_deck_position',
+            field=models.PositiveIntegerField(default=0, verbose_name='Позиция в колоде ребусов'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 3.1.2 on 2026-10-18 06:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0034_auto_20261018_0955'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rebus',
+            name='image_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='SHA-256 изображения'),
+        ),
+        migrations.AddField(
+            model_name='rebus',
+            name='telegram_file_id',
+            field=models.CharField(blank=True, editable=False, help_text='Изображение уже загружено в Telegram, повторно его отправлять не нужно', max_length=200, verbose_name='Telegram file_id изображения'),
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:08
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def build_draw_progress(apps, schema_editor):
+    # the progress in the draws held so far, as the rebuild_draw_progress command counts it
+    Draw = apps.get_model('telegram_bot', 'Draw')
+    DrawProgress = apps.get_model('telegram_bot', 'DrawProgress')
+    RebusAttempt = apps.get_model('telegram_bot', 'RebusAttempt')
+    for draw in Draw.objects.all():
+        solved_by_players = RebusAttempt.objects.filter(
+            success=True, answer_received_at__range=(draw.start_at, draw.end_at),
+        ).values('user').annotate(solved=Count('id'))
+        DrawProgress.objects.bulk_create(
+            [DrawProgress(player_id=row['user'], draw=draw, solved=row['solved']) for row in solved_by_players],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0035_auto_20261018_0956'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DrawProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('solved', models.PositiveIntegerField(default=0, verbose_name='Отгадано ребусов')),
+                ('draw', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='progress', to='telegram_bot.draw', verbose_name='Розыгрыш')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='draw_progress', to='telegram_bot.player', verbose_name='Участник')),
+            ],
+            options={
+                'verbose_name': 'Прогресс в розыгрыше',
+                'verbose_name_plural': 'Прогресс в розыгрышах',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='drawprogress',
+            constraint=models.UniqueConstraint(fields=('player', 'draw'), name='unique_player_draw_progress'),
+        ),
+        migrations.RunPython(build_draw_progress, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:11
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+import django.db.models.deletion
+
+
+def merge_duplicate_players(apps, schema_editor):
+    # the oldest player with a telegram id keeps the attempts and polls of the duplicates
+    Player = apps.get_model('telegram_bot', 'Player')
+    RebusAttempt = apps.get_model('telegram_bot', 'RebusAttempt')
+    PollResult = apps.get_model('telegram_bot', 'PollResult')
+    DrawProgress = apps.get_model('telegram_bot', 'DrawProgress')
+    Draw = apps.get_model('telegram_bot', 'Draw')
+    duplicates = Player.objects.filter(telegram_id__isnull=False).values('telegram_id')\
+        .annotate(players=Count('id'), first_id=Min('id')).filter(players__gt=1)
+    for duplicate in duplicates:
+        duplicate_players = Player.objects.filter(telegram_id=duplicate['telegram_id'])\
+            .exclude(pk=duplicate['first_id'])
+        # the registration could have been finished by a newer duplicate
+        player = Player.objects.get(pk=duplicate['first_id'])
+        for duplicate_player in duplicate_players.order_by('-id'):
+            player.full_name = player.full_name or duplicate_player.full_name
+            player.phone_number = player.phone_number or duplicate_player.phone_number
+            player.gift_received = player.gift_received or duplicate_player.gift_received
+        player.save(update_fields=['full_name', 'phone_number', 'gift_received'])
+        RebusAttempt.objects.filter(user__in=duplicate_players).update(user_id=duplicate['first_id'])
+        PollResult.objects.filter(user__in=duplicate_players).update(user_id=duplicate['first_id'])
+        DrawProgress.objects.filter(player__in=duplicate_players).delete()
+        duplicate_players.delete()
+        # the attempts of the duplicates count for the player now
+        DrawProgress.objects.filter(player_id=duplicate['first_id']).delete()
+        for draw in Draw.objects.all():
+            solved = RebusAttempt.objects.filter(
+                user_id=duplicate['first_id'], success=True,
+                answer_received_at__range=(draw.start_at, draw.end_at),
+            ).count()
+            if solved:
+                DrawProgress.objects.create(player_id=duplicate['first_id'], draw=draw, solved=solved)
+    if schema_editor.connection.vendor == 'postgresql':
+        # the foreign keys are checked at the end of the transaction, PostgreSQL doesn't
+        # alter the tables below while these checks are pending
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0036_auto_20261018_1008'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_players, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='drawprogress',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='draw_progress', to='telegram_bot.player', verbose_name='Участник'),
+        ),
+        migrations.AlterField(
+            model_name='player',
+            name='telegram_id',
+            field=models.IntegerField(blank=True, null=True, unique=True, verbose_name='Telegram Id'),
+        ),
+        migrations.AlterField(
+            model_name='pollresult',
+            name='user',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='poll_results', to='telegram_bot.player', verbose_name='Участник'),
+        ),
+        migrations.AddIndex(
+            model_name='pollresult',
+            index=models.Index(fields=['user', 'poll_finished'], name='pollresult_user_finished'),
+        ),
+        migrations.AddIndex(
+            model_name='rebusattempt',
+            index=models.Index(condition=models.Q(success=True), fields=['user', 'rebus'], name='rebusattempt_user_solved'),
+        ),
+        migrations.AddIndex(
+            model_name='rebusattempt',
+            index=models.Index(condition=models.Q(success=True), fields=['answer_received_at'], name='rebusattempt_solved_at'),
+        ),
+    ]
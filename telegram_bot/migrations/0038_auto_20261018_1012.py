@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0037_auto_20261018_1011'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='telegram_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True, verbose_name='Telegram Id'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0038_auto_20261018_1012'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledNotification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.BigIntegerField(verbose_name='Чат')),
+                ('kind', models.CharField(choices=[('draw_started', 'Розыгрыш начался'), ('draw_ending', 'Розыгрыш скоро закончится'), ('draw_finished', 'Розыгрыш закончился')], max_length=20, verbose_name='Уведомление')),
+                ('due_at', models.DateTimeField(db_index=True, verbose_name='Отправить в')),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='Отправляется до')),
+                ('draw', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='telegram_bot.draw', verbose_name='Розыгрыш')),
+            ],
+            options={
+                'verbose_name': 'Запланированное уведомление',
+                'verbose_name_plural': 'Запланированные уведомления',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='schedulednotification',
+            constraint=models.UniqueConstraint(fields=('chat_id', 'kind', 'draw'), name='unique_chat_notification'),
+        ),
+    ]
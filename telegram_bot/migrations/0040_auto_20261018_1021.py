@@ -0,0 +1,38 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0039_auto_20261018_1016'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PollQuestion',
+            fields=[
+                ('id', models.SmallAutoField(primary_key=True, serialize=False)),
+                ('slug', models.SlugField(allow_unicode=True, max_length=100, unique=True, verbose_name='Slug вопроса')),
+                ('text', models.TextField(verbose_name='Текст вопроса')),
+                ('order', models.PositiveSmallIntegerField(default=0, verbose_name='Порядок')),
+            ],
+            options={
+                'verbose_name': 'Вопрос опроса',
+                'verbose_name_plural': 'Вопросы опроса',
+                'ordering': ['order', 'id'],
+            },
+        ),
+        migrations.RenameField(
+            model_name='pollquestionanswerpair',
+            old_name='question',
+            new_name='question_text',
+        ),
+        migrations.AddField(
+            model_name='pollquestionanswerpair',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, related_name='answer_pairs', to='telegram_bot.pollquestion', verbose_name='Вопрос'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:25
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0040_auto_20261018_1021'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportArtifact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=50, verbose_name='Выгрузка')),
+                ('params', models.CharField(blank=True, max_length=500, verbose_name='Параметры')),
+                ('version', models.PositiveIntegerField(verbose_name='Версия')),
+                ('watermark', models.CharField(help_text='Пока оно не изменилось, готовую выгрузку не нужно собирать заново', max_length=200, verbose_name='Состояние данных')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('running', 'Готовится'), ('done', 'Готова'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('rows_done', models.PositiveIntegerField(default=0, verbose_name='Выгружено строк')),
+                ('rows_total', models.PositiveIntegerField(blank=True, null=True, verbose_name='Всего строк')),
+                ('file', models.FileField(blank=True, upload_to='exports/', verbose_name='Файл')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Создана в')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Обновлена в')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка',
+                'verbose_name_plural': 'Выгрузки',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='exportartifact',
+            constraint=models.UniqueConstraint(fields=('kind', 'params', 'version'), name='unique_export_version'),
+        ),
+    ]
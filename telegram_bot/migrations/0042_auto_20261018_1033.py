@@ -0,0 +1,23 @@
+# Generated by Django 3.1.2 on 2026-10-18 07:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0041_auto_20261018_1025'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rebus',
+            name='telegram_image',
+            field=models.ImageField(blank=True, editable=False, upload_to='rebuses/telegram/', verbose_name='Изображение для Telegram'),
+        ),
+        migrations.AddField(
+            model_name='rebus',
+            name='thumbnail',
+            field=models.ImageField(blank=True, editable=False, upload_to='rebuses/thumbnails/', verbose_name='Миниатюра'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.2 on 2026-10-18 11:05
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0042_auto_20261018_1033'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, default=django.utils.timezone.now, verbose_name='Изменён в'),
+            preserve_default=False,
+        ),
+    ]
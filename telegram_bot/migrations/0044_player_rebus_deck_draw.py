@@ -0,0 +1,18 @@
+# Generated by Django 3.1.2 on 2026-10-18 08:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0043_player_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='rebus_deck_draw',
+            field=models.IntegerField(blank=True, help_text='id розыгрыша, для которого перемешана колода', null=True, verbose_name='Розыгрыш колоды ребусов'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 3.1.2 on 2026-10-18 12:10
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Case, Min, Value, When
+from django.utils.text import slugify
+
+
+def get_question_slug(text):
+    slug = slugify(text, allow_unicode=True) or hashlib.md5(text.encode()).hexdigest()
+    if len(slug) > 100:
+        slug = f'{slug[:91]}-{hashlib.md5(slug.encode()).hexdigest()[:8]}'
+    return slug
+
+
+def fill_question_catalog(apps, schema_editor):
+    # texts of one question edited only in case or punctuation become one question
+    PollQuestion = apps.get_model('telegram_bot', 'PollQuestion')
+    PollQuestionAnswerPair = apps.get_model('telegram_bot', 'PollQuestionAnswerPair')
+    texts = PollQuestionAnswerPair.objects.values('question_text').annotate(
+        first_id=Min('id')
+    ).order_by('first_id').values_list('question_text', flat=True)
+    questions = {}
+    slugs = {}
+    for order, text in enumerate(texts):
+        slugs[text] = get_question_slug(text)
+        questions.setdefault(slugs[text], PollQuestion(slug=slugs[text], text=text, order=order))
+    if not questions:
+        return
+    PollQuestion.objects.bulk_create(questions.values())
+    question_ids = dict(PollQuestion.objects.values_list('slug', 'id'))
+    PollQuestionAnswerPair.objects.update(question_id=Case(
+        *[When(question_text=text, then=Value(question_ids[slug])) for text, slug in slugs.items()],
+        output_field=models.IntegerField(),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0044_player_rebus_deck_draw'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_question_catalog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.1.2 on 2026-10-18 12:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0045_fill_poll_question_catalog'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pollquestionanswerpair',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='answer_pairs', to='telegram_bot.pollquestion', verbose_name='Вопрос'),
+        ),
+        migrations.RemoveField(
+            model_name='pollquestionanswerpair',
+            name='question_text',
+        ),
+        migrations.RemoveField(
+            model_name='pollquestionanswerpair',
+            name='slug',
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 3.1.2 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0046_require_poll_question'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pollquestion',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Изменён в'),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.2 on 2026-10-18 12:50
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def fill_params_hash(apps, schema_editor):
+    ExportArtifact = apps.get_model('telegram_bot', 'ExportArtifact')
+    for artifact in ExportArtifact.objects.all():
+        artifact.params_hash = hashlib.sha256(artifact.params.encode()).hexdigest()
+        artifact.save(update_fields=['params_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('telegram_bot', '0047_pollquestion_updated_at'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='exportartifact',
+            name='unique_export_version',
+        ),
+        migrations.AlterField(
+            model_name='exportartifact',
+            name='params',
+            field=models.TextField(blank=True, verbose_name='Параметры'),
+        ),
+        migrations.AddField(
+            model_name='exportartifact',
+            name='params_hash',
+            field=models.CharField(default='', editable=False, max_length=64, verbose_name='SHA-256 параметров'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_params_hash, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='exportartifact',
+            constraint=models.UniqueConstraint(fields=('kind', 'params_hash', 'version'), name='unique_export_version'),
+        ),
+    ]
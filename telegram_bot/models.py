@@ -1,5 +1,71 @@
+import copy
+import datetime
+import random
+import hashlib
+
+from django.conf import settings
+from django.utils.text import slugify
 from django.utils.timezone import localtime, now
-from django.db import models
+from django.db import DatabaseError, IntegrityError, connection, models, transaction
+from django.db.models import Count, F, OuterRef, Q, Subquery
+
+from .rebus_images import THUMBNAIL_SIZE, TELEGRAM_SIZE, delete_on_commit, get_derivative_name, make_derivative
+from .write_buffer import write_buffer
+
+
+class TrackedFieldsMixin:
+    # Remembers the field values which are in the database, so save_changes() writes
+    # only the fields changed since then, or doesn't touch the database at all
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_saved_values()
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        self.remember_saved_values(kwargs.get('update_fields'))
+
+    def remember_saved_values(self, field_names=None):
+        if field_names is None:
+            self._saved_values = {}
+            attnames = [field.attname for field in self._meta.concrete_fields]
+        else:
+            attnames = [self._meta.get_field(name).attname for name in field_names]
+        for attname in attnames:
+            # deferred fields are not loaded, so they are not known to be saved
+            if attname in self.__dict__:
+                self._saved_values[attname] = copy.copy(self.__dict__[attname])
+
+    def get_changed_fields(self):
+        saved_values = getattr(self, '_saved_values', {})
+        return [
+            field.attname for field in self._meta.concrete_fields
+            if field.attname in self.__dict__ and (
+                field.attname not in saved_values or saved_values[field.attname] != self.__dict__[field.attname]
+            )
+        ]
+
+    def save_changes(self):
+        if self._state.adding:
+            self.save()
+            return [field.attname for field in self._meta.concrete_fields]
+        changed_fields = self.get_changed_fields()
+        if changed_fields:
+            # auto_now fields are updated with any change, like on a full save
+            auto_now_fields = [
+                field.attname for field in self._meta.concrete_fields if getattr(field, 'auto_now', False)
+            ]
+            try:
+                self.save(update_fields=set(changed_fields + auto_now_fields))
+            except DatabaseError as error:
+                # Django raises the bare DatabaseError when the UPDATE matched no rows,
+                # errors of the database itself are its subclasses
+                if type(error) is not DatabaseError:
+                    raise
+                raise self.DoesNotExist(f'{self._meta.object_name} {self.pk} was deleted') from error
+        return changed_fields
 
 
 class DrawQuerySet(models.QuerySet):
@@ -8,14 +74,20 @@ class DrawQuerySet(models.QuerySet):
         return self.filter(start_at__lte=now(), end_at__gte=now())
 
     def get_future(self):
-        future_draw = self.filter(start_at__gte=now())
-        return future_draw.first() if future_draw else None
+        return self.filter(start_at__gte=now()).order_by('start_at').first()
 
     def get_draw(self):
-        draw = self.get_current_draw()
-        if draw:
-            return draw.first()
-        return self.get_future()
+        return self.get_current_draw().first() or self.get_future()
+
+    def with_solved_by(self, player):
+        return self.annotate(solved=Subquery(
+            DrawProgress.objects.filter(player=player, draw=OuterRef('pk')).values('solved')[:1]
+        ))
+
+    def with_winners_count(self):
+        return self.annotate(winners_count=Count(
+            'progress', filter=Q(progress__solved__gte=settings.MAX_PUZZLES_TO_WIN)
+        ))
 
 
 class Draw(models.Model):
@@ -40,7 +112,53 @@ class Draw(models.Model):
         return self.title
 
 
-class Player(models.Model):
+class PlayerQuerySet(models.QuerySet):
+
+    def register(self, telegram_id):
+        # Returns the player with this telegram id, creating it if needed. On PostgreSQL
+        # it's one round trip which never creates duplicates, even when hundreds of
+        # new chats send /start at the same moment.
+        if connection.vendor != 'postgresql':
+            try:
+                with transaction.atomic():
+                    player, _ = self.get_or_create(telegram_id=telegram_id, defaults={'created_at': now()})
+                return player
+            except IntegrityError:
+                return self.get(telegram_id=telegram_id)
+
+        new_player = self.model(telegram_id=telegram_id, created_at=now())
+        fields = [field for field in self.model._meta.concrete_fields if not field.primary_key]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        placeholders = ', '.join(['%s'] * len(fields))
+        values = [field.get_db_prep_save(field.pre_save(new_player, True), connection) for field in fields]
+        telegram_id_column = connection.ops.quote_name(self.model._meta.get_field('telegram_id').column)
+        players = list(self.raw(
+            f'''
+            WITH inserted AS (
+                INSERT INTO {table} ({columns}) VALUES ({placeholders})
+                ON CONFLICT ({telegram_id_column}) DO NOTHING
+                RETURNING *
+            )
+            SELECT * FROM inserted
+            UNION ALL
+            SELECT * FROM {table} WHERE {telegram_id_column} = %s
+            LIMIT 1
+            ''',
+            values + [telegram_id],
+        ))
+        if players:
+            return players[0]
+        # the player was inserted by a concurrent transaction which committed after
+        # this statement had started, so the statement couldn't see it
+        return self.get(telegram_id=telegram_id)
+
+    def winners_of(self, draw):
+        # players who solved enough rebuses during the draw to take part in it
+        return self.filter(draw_progress__draw=draw, draw_progress__solved__gte=settings.MAX_PUZZLES_TO_WIN)
+
+
+class Player(TrackedFieldsMixin, models.Model):
     CURRENT_COMPETITION = [
         ('РЕБУС', 'is_rebus'),
         ('ОПРОС', 'is_poll'),
@@ -67,9 +185,10 @@ class Player(models.Model):
         blank=True,
         null=True,
     )
-    telegram_id = models.IntegerField(
+    updated_at = models.DateTimeField('Изменён в', auto_now=True, db_index=True)
+    telegram_id = models.BigIntegerField(
         'Telegram Id',
-        db_index=True,
+        unique=True,
         blank=True,
         null=True
     )
@@ -87,6 +206,21 @@ class Player(models.Model):
     gift_received = models.BooleanField('Получил подарок', default=False)
     is_current_rebus_finished = models.BooleanField(default=False)
     current_rebus = models.IntegerField(null=True, blank=True)
+    rebus_deck = models.JSONField(
+        'Колода ребусов',
+        default=list,
+        blank=True,
+        help_text='Перемешанные id ребусов, участник получает их по порядку',
+    )
+    rebus_deck_position = models.PositiveIntegerField('Позиция в колоде ребусов', default=0)
+    rebus_deck_draw = models.IntegerField(
+        'Розыгрыш колоды ребусов',
+        null=True,
+        blank=True,
+        help_text='id розыгрыша, для которого перемешана колода',
+    )
+
+    objects = PlayerQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Участник'
@@ -96,44 +230,64 @@ class Player(models.Model):
         #  TypeError: __str__ returned non-string (type NoneType)
         return f'{self.full_name}'
 
-    def change_current_rebus(self, current_rebus):
-        self.current_rebus = current_rebus
-        self.save()
-
-    def change_current_competition(self, current_competition):
-        self.current_competition = current_competition
-        self.save()
-
-    def change_current_rebus_finished(self, current_rebus_finished):
-        self.is_current_rebus_finished = current_rebus_finished
-        self.save()
-
     def is_finished_poll(self):
         is_poll = self.poll_results.filter(poll_finished=True).exists()
         return is_poll
 
-    def get_current_rebus(self):
-        rebus = Rebus.objects.filter(pk=self.current_rebus).first()
-        return rebus if rebus else None
+    def deal_rebus_deck(self, rebus_ids, draw=None):
+        # rebuses solved during the draw stay in the deck before the position, so they are
+        # known and never confused with rebuses published later. Progress is counted per
+        # draw, so outside of a draw nothing counts as solved.
+        solved_ids = set()
+        if draw:
+            solved_ids = set(
+                RebusAttempt.objects.successful_during(draw).filter(user=self).values_list('rebus_id', flat=True)
+            )
+        fresh_ids = sorted(set(rebus_ids) - solved_ids)
+        random.Random(self.pk).shuffle(fresh_ids)
+        self.rebus_deck = sorted(solved_ids & set(rebus_ids)) + fresh_ids
+        self.rebus_deck_position = len(self.rebus_deck) - len(fresh_ids)
+        self.rebus_deck_draw = draw.id if draw else None
+
+    def draw_rebus_id(self, published_ids):
+        # a deck dealt in the previous draw is dealt again, the player solves every rebus anew
+        draw = Draw.objects.get_current_draw().first()
+        if self.rebus_deck_position >= len(self.rebus_deck) or self.rebus_deck_draw != (draw.id if draw else None):
+            self.deal_rebus_deck(published_ids, draw)
+        new_ids = sorted(published_ids.difference(self.rebus_deck))
+        if new_ids:
+            random.Random(self.pk).shuffle(new_ids)
+            self.rebus_deck = self.rebus_deck + new_ids
+        while self.rebus_deck_position < len(self.rebus_deck):
+            rebus_id = self.rebus_deck[self.rebus_deck_position]
+            self.rebus_deck_position += 1
+            if rebus_id in published_ids:
+                return rebus_id
+        return None
 
 
 class RebusQuerySet(models.QuerySet):
 
-    def fresh(self, user):
-        return self.exclude(rebus_attempts__user=user, rebus_attempts__success=True)
-
-    def next(self):
-        return self.order_by('?').first()
+    def published(self):
+        return self.filter(published=True)
 
     def add_attempt(self, rebus_id, user, user_answer, success, rebus_sendet_at):
-        return RebusAttempt.objects.create(
-            rebus=self.get(pk=rebus_id),
+        attempt = RebusAttempt(
+            rebus_id=rebus_id,
             user=user,
             answer=user_answer,
             success=success,
             answer_received_at=now(),
             rebus_sendet_at=rebus_sendet_at,
         )
+        if success:
+            # the progress of the player is counted from successful attempts
+            with transaction.atomic():
+                attempt.save()
+                DrawProgress.objects.add_solved(user, attempt.answer_received_at)
+        else:
+            write_buffer.add(attempt)
+        return attempt
 
 
 class Rebus(models.Model):
@@ -141,7 +295,22 @@ class Rebus(models.Model):
     image = models.ImageField('Изображения')
     published = models.BooleanField('Опубликовать', default=False)
     hint = models.TextField('Подсказка', blank=True)
-    
+    image_hash = models.CharField('SHA-256 изображения', max_length=64, blank=True, editable=False)
+    thumbnail = models.ImageField('Миниатюра', upload_to='rebuses/thumbnails/', blank=True, editable=False)
+    telegram_image = models.ImageField(
+        'Изображение для Telegram',
+        upload_to='rebuses/telegram/',
+        blank=True,
+        editable=False,
+    )
+    telegram_file_id = models.CharField(
+        'Telegram file_id изображения',
+        max_length=200,
+        blank=True,
+        editable=False,
+        help_text='Изображение уже загружено в Telegram, повторно его отправлять не нужно',
+    )
+
     objects = RebusQuerySet.as_manager()
 
     class Meta:
@@ -151,6 +320,33 @@ class Rebus(models.Model):
     def __str__(self):
         return f'Ребус {self.id}'
 
+    def save(self, *args, **kwargs):
+        replaced_files = []
+        if self.image and not self.image._committed:
+            # a new image was uploaded, the file_id of the old one doesn't fit anymore
+            image_hash = hashlib.sha256()
+            for chunk in self.image.chunks():
+                image_hash.update(chunk)
+            self.image_hash = image_hash.hexdigest()
+            self.telegram_file_id = ''
+            replaced_files = self.build_derivatives()
+        super().save(*args, **kwargs)
+        delete_on_commit(self.thumbnail.storage, replaced_files)
+
+    def build_derivatives(self):
+        # smaller copies of the image: a thumbnail for the admin and a recompressed one to upload to Telegram,
+        # returns the names of the copies they replace
+        replaced_files = [file.name for file in (self.thumbnail, self.telegram_image) if file]
+        name = get_derivative_name(self.image.name)
+        self.thumbnail.save(name, make_derivative(self.image, THUMBNAIL_SIZE), save=False)
+        self.telegram_image.save(name, make_derivative(self.image, TELEGRAM_SIZE), save=False)
+        return replaced_files
+
+    def remember_telegram_file_id(self, file_id):
+        # the image could have been replaced while it was being uploaded
+        Rebus.objects.filter(pk=self.pk, image_hash=self.image_hash).update(telegram_file_id=file_id)
+        self.telegram_file_id = file_id
+
 
 class Answer(models.Model):
     rebus = models.ForeignKey(
@@ -172,9 +368,8 @@ class Answer(models.Model):
 
 class RebusAttemptQuerySet(models.QuerySet):
 
-    def get_amount_rebus_seccusses_attempts(self, user):
-        amount = self.filter(success=True, user=user).count()
-        return amount
+    def successful_during(self, draw):
+        return self.filter(success=True, answer_received_at__range=(draw.start_at, draw.end_at))
 
 
 class RebusAttempt(models.Model):
@@ -210,70 +405,182 @@ class RebusAttempt(models.Model):
     class Meta:
         verbose_name = 'Попытка решить ребус'
         verbose_name_plural = 'Попытки решить ребус'
+        indexes = [
+            # rebuses solved by a player, when the rebus deck is dealt
+            models.Index(fields=['user', 'rebus'], condition=Q(success=True), name='rebusattempt_user_solved'),
+            # successful attempts within a draw, for the draw progress and its participants
+            models.Index(fields=['answer_received_at'], condition=Q(success=True), name='rebusattempt_solved_at'),
+        ]
 
     def __str__(self):
         return f'{self.user.full_name}'
 
 
+class DrawProgressQuerySet(models.QuerySet):
+
+    def get_solved(self, player, moment):
+        solved = self.filter(
+            player=player, draw__start_at__lte=moment, draw__end_at__gte=moment
+        ).values_list('solved', flat=True).first()
+        return solved or 0
+
+    def add_solved(self, player, moment):
+        current_draws = Draw.objects.filter(start_at__lte=moment, end_at__gte=moment)
+        if self.filter(player=player, draw__in=current_draws).update(solved=F('solved') + 1):
+            return
+        draw = current_draws.first()
+        if not draw:
+            return
+        try:
+            with transaction.atomic():
+                self.create(player=player, draw=draw, solved=1)
+        except IntegrityError:
+            # the first success of the player in the draw was recorded concurrently
+            self.filter(player=player, draw=draw).update(solved=F('solved') + 1)
+
+    def rebuild(self, draw):
+        self.filter(draw=draw).delete()
+        solved_by_players = RebusAttempt.objects.successful_during(draw).values('user').annotate(solved=Count('id'))
+        self.bulk_create(
+            [self.model(player_id=row['user'], draw=draw, solved=row['solved']) for row in solved_by_players],
+            batch_size=1000,
+        )
+
+
+class DrawProgress(models.Model):
+    player = models.ForeignKey(
+        Player,
+        on_delete=models.CASCADE,
+        verbose_name='Участник',
+        related_name='draw_progress',
+        db_index=False,  # the unique constraint starts with the player
+    )
+    draw = models.ForeignKey(
+        Draw,
+        on_delete=models.CASCADE,
+        verbose_name='Розыгрыш',
+        related_name='progress',
+    )
+    solved = models.PositiveIntegerField('Отгадано ребусов', default=0)
+
+    objects = DrawProgressQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Прогресс в розыгрыше'
+        verbose_name_plural = 'Прогресс в розыгрышах'
+        constraints = [
+            models.UniqueConstraint(fields=['player', 'draw'], name='unique_player_draw_progress'),
+        ]
+
+    def __str__(self):
+        return f'{self.player} в {self.draw}: {self.solved}'
+
+
+class ScheduledNotificationQuerySet(models.QuerySet):
+
+    def schedule(self, chat_id, kind, draw):
+        # scheduling the same notification again changes nothing
+        notification = self.model(chat_id=chat_id, kind=kind, draw=draw)
+        notification.due_at = notification.get_due_at(draw)
+        self.bulk_create([notification], ignore_conflicts=True)
+
+    def cancel(self, chat_id, *kinds):
+        self.filter(chat_id=chat_id, kind__in=kinds).delete()
+
+    def claim(self, moment, limit, lease):
+        # claimed rows are skipped by other pollers until the lease expires, so the rows
+        # of a poller which died before sending them are sent by the next one
+        with transaction.atomic():
+            notifications = list(
+                self.filter(due_at__lte=moment)
+                .filter(Q(claimed_until__isnull=True) | Q(claimed_until__lt=moment))
+                .order_by('due_at')
+                .select_for_update(skip_locked=True)[:limit]
+            )
+            self.filter(pk__in=[notification.pk for notification in notifications]).update(
+                claimed_until=moment + lease
+            )
+        return notifications
+
+    def extend_claim(self, notification_ids, claimed_until):
+        self.filter(pk__in=notification_ids).update(claimed_until=claimed_until)
+
+    def reschedule(self, notification_ids, due_at):
+        self.filter(pk__in=notification_ids).update(due_at=due_at, claimed_until=None)
+
+    def follow_draw(self, draw):
+        for kind, _ in self.model.KINDS:
+            self.filter(draw=draw, kind=kind).update(due_at=self.model(kind=kind).get_due_at(draw))
+
+
+class ScheduledNotification(models.Model):
+    DRAW_STARTED = 'draw_started'
+    DRAW_ENDING = 'draw_ending'
+    DRAW_FINISHED = 'draw_finished'
+    KINDS = [
+        (DRAW_STARTED, 'Розыгрыш начался'),
+        (DRAW_ENDING, 'Розыгрыш скоро закончится'),
+        (DRAW_FINISHED, 'Розыгрыш закончился'),
+    ]
+    REMIND_BEFORE_END = datetime.timedelta(minutes=5)
+
+    chat_id = models.BigIntegerField('Чат')
+    kind = models.CharField('Уведомление', max_length=20, choices=KINDS)
+    draw = models.ForeignKey(
+        Draw,
+        on_delete=models.CASCADE,
+        verbose_name='Розыгрыш',
+        related_name='notifications',
+    )
+    due_at = models.DateTimeField('Отправить в', db_index=True)
+    claimed_until = models.DateTimeField('Отправляется до', null=True, blank=True)
+
+    objects = ScheduledNotificationQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запланированное уведомление'
+        verbose_name_plural = 'Запланированные уведомления'
+        constraints = [
+            models.UniqueConstraint(fields=['chat_id', 'kind', 'draw'], name='unique_chat_notification'),
+        ]
+
+    def __str__(self):
+        return f'{self.get_kind_display()} для {self.chat_id}'
+
+    def get_due_at(self, draw):
+        if self.kind == self.DRAW_STARTED:
+            return draw.start_at
+        if self.kind == self.DRAW_ENDING:
+            return draw.end_at - self.REMIND_BEFORE_END
+        return draw.end_at
+
+
 class PollResultQuerySet(models.QuerySet):
     def active_for_user(self, user):
         return self.filter(user=user, poll_finished=False).first()
 
-    def get_current_question_by_user(self, user):
-        user_poll = self.active_for_user(user)
-        return user_poll.current_question if user_poll else 0
-
-    def get_poll_id(self, user):
-        user_poll = self.active_for_user(user)
-        if not user_poll:
-            new_poll = PollResult(
-                user=user,
-                started_at=now()
-            )
-            new_poll.save()
-        return new_poll.id if not user_poll else user_poll.id
+    def start(self, user):
+        return self.create(user=user, started_at=now())
 
-    def add_question_answer_pair(
-        self, poll_id, question_slug, question, answer, asked_at,
-    ):
-        poll = self.get(pk=poll_id)
+    def add_question_answer_pair(self, poll_id, question_id, answer, asked_at):
         question_asnwer_pair = PollQuestionAnswerPair(
-            poll=poll,
-            slug=question_slug,
-            question=question,
+            poll_id=poll_id,
+            question_id=question_id,
             answer=answer,
             asked_at=asked_at,
             answered_at=now()
         )
-        question_asnwer_pair.save()
-
-    def save_current_question(self, user, current_question):
-        user_poll = self.active_for_user(user)
-        if user_poll:
-            user_poll.current_question = current_question
-            user_poll.save()
-
-    def finish_poll(self, user, current_question, poll_finished):
-        user_poll = self.active_for_user(user)
-        if user_poll:
-            user_poll.current_question = current_question
-            user_poll.poll_finished = poll_finished
-            user_poll.ended_at = now()
-            user_poll.save()
+        write_buffer.add(question_asnwer_pair)
 
-    def del_unfinished_poll(self, user):
-        user_poll = self.active_for_user(user)
-        if user_poll:
-            user_poll.delete()
 
-
-class PollResult(models.Model):
+class PollResult(TrackedFieldsMixin, models.Model):
     user = models.ForeignKey(
         Player,
         related_name='poll_results',
         verbose_name='Участник',
         on_delete=models.SET_NULL,
-        null=True
+        null=True,
+        db_index=False,  # pollresult_user_finished starts with the user
     )
     current_question = models.IntegerField('Текущий вопрос', default=0)
     poll_finished = models.BooleanField('Закончил опрос', default=False)
@@ -295,10 +602,72 @@ class PollResult(models.Model):
     class Meta:
         verbose_name = 'Опрос'
         verbose_name_plural = 'Опросы'
+        indexes = [
+            # the active poll of a player and whether the player has finished one
+            models.Index(fields=['user', 'poll_finished'], name='pollresult_user_finished'),
+        ]
 
     def __str__(self):
         return f'Опрос_{self.id}'
 
+    def finish(self, current_question):
+        self.current_question = current_question
+        self.poll_finished = True
+        self.ended_at = now()
+        self.save_changes()
+
+
+def get_question_slug(text):
+    # a question keeps its slug when only its case or punctuation is edited
+    slug = slugify(text, allow_unicode=True) or hashlib.md5(text.encode()).hexdigest()
+    if len(slug) > 100:
+        # the hash tells apart long questions with the same beginning
+        slug = f'{slug[:91]}-{hashlib.md5(slug.encode()).hexdigest()[:8]}'
+    return slug
+
+
+class PollQuestionQuerySet(models.QuerySet):
+
+    def sync(self, texts):
+        # adds the questions of the poll to the catalog and returns their ids in the same order,
+        # questions removed from the poll stay in the catalog for the answers given to them
+        questions = {}
+        for order, text in enumerate(texts):
+            slug = get_question_slug(text)
+            question = questions.setdefault(slug, self.model(slug=slug, text=text, order=order))
+            if question.text != text:
+                # their answers would be saved as answers to the same question
+                raise ValueError(f'Poll questions {question.text!r} and {text!r} differ only in case or punctuation')
+        self.bulk_create(questions.values(), ignore_conflicts=True)
+        saved_questions = self.in_bulk(questions, field_name='slug')
+        changed_questions = []
+        for slug, question in questions.items():
+            saved_question = saved_questions[slug]
+            if (saved_question.text, saved_question.order) != (question.text, question.order):
+                saved_question.text, saved_question.order = question.text, question.order
+                saved_question.updated_at = now()
+                changed_questions.append(saved_question)
+        self.bulk_update(changed_questions, ['text', 'order', 'updated_at'])
+        return [saved_questions[get_question_slug(text)].id for text in texts]
+
+
+class PollQuestion(models.Model):
+    id = models.SmallAutoField(primary_key=True)
+    slug = models.SlugField('Slug вопроса', max_length=100, unique=True, allow_unicode=True)
+    text = models.TextField('Текст вопроса')
+    order = models.PositiveSmallIntegerField('Порядок', default=0)
+    updated_at = models.DateTimeField('Изменён в', auto_now=True)
+
+    objects = PollQuestionQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Вопрос опроса'
+        verbose_name_plural = 'Вопросы опроса'
+        ordering = ['order', 'id']
+
+    def __str__(self):
+        return self.text
+
 
 class PollQuestionAnswerPair(models.Model):
     poll = models.ForeignKey(
@@ -308,8 +677,12 @@ class PollQuestionAnswerPair(models.Model):
         on_delete=models.SET_NULL,
         null=True
     )
-    slug = models.SlugField('Slug вопроса', null=True)
-    question = models.TextField('Вопрос')
+    question = models.ForeignKey(
+        PollQuestion,
+        related_name='answer_pairs',
+        verbose_name='Вопрос',
+        on_delete=models.PROTECT,
+    )
     answer = models.CharField('Ответ', max_length=200)
     asked_at = models.DateTimeField(
         verbose_name='Получил вопрос в',
@@ -330,3 +703,43 @@ class PollQuestionAnswerPair(models.Model):
 
     def __str__(self):
         return f'Вопрос_{self.id}'
+
+
+class ExportArtifact(models.Model):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Готовится'),
+        (DONE, 'Готова'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    kind = models.CharField('Выгрузка', max_length=50)
+    params = models.TextField('Параметры', blank=True)
+    params_hash = models.CharField('SHA-256 параметров', max_length=64, editable=False)
+    version = models.PositiveIntegerField('Версия')
+    watermark = models.CharField(
+        'Состояние данных',
+        max_length=200,
+        help_text='Пока оно не изменилось, готовую выгрузку не нужно собирать заново',
+    )
+    status = models.CharField('Статус', max_length=20, choices=STATUSES, default=PENDING)
+    rows_done = models.PositiveIntegerField('Выгружено строк', default=0)
+    rows_total = models.PositiveIntegerField('Всего строк', null=True, blank=True)
+    file = models.FileField('Файл', upload_to='exports/', blank=True)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Создана в', default=now)
+    updated_at = models.DateTimeField('Обновлена в', default=now)
+
+    class Meta:
+        verbose_name = 'Выгрузка'
+        verbose_name_plural = 'Выгрузки'
+        constraints = [
+            models.UniqueConstraint(fields=['kind', 'params_hash', 'version'], name='unique_export_version'),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} v{self.version}'
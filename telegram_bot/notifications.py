@@ -0,0 +1,91 @@
+import logging
+import datetime
+from collections import defaultdict
+
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from . import metrics
+from .models import Draw, ScheduledNotification
+
+
+LEASE = datetime.timedelta(minutes=5)
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationPoller:
+    # Notifications are rows of ScheduledNotification, so a restart doesn't lose them.
+    # One repeating job claims due rows by the due_at index in batches and hands them
+    # to the handler of their kind grouped by draw. A handler returns a dict of the
+    # notification ids it took care of: a Future of the sent message, then the row is
+    # deleted once the message is sent, or a datetime to send the notification again at.
+    # Rows the handler skipped are deleted right away.
+    def __init__(self, handlers, interval=5, batch_size=500):
+        self.handlers = handlers
+        self.interval = interval
+        self.batch_size = batch_size
+        self._sending = {}  # notification id: Future of the sent message
+        metrics.register_gauge('notifications.sending', lambda: len(self._sending))
+
+    def start(self, job_queue):
+        job_queue.run_repeating(self.tick, interval=self.interval, first=0, name='notifications')
+
+    def tick(self, context):
+        close_old_connections()
+        self.delete_sent()
+        self.extend_leases()
+        while True:
+            notifications = ScheduledNotification.objects.claim(now(), self.batch_size, LEASE)
+            if not notifications:
+                break
+            metrics.incr('notifications.claimed', len(notifications))
+            self.notify(context.bot, notifications)
+            if len(notifications) < self.batch_size:
+                break
+
+    def notify(self, bot, notifications):
+        groups = defaultdict(list)
+        for notification in notifications:
+            groups[notification.kind, notification.draw_id].append(notification)
+        draws = Draw.objects.in_bulk({draw_id for _, draw_id in groups})
+        skipped_ids, rescheduled = [], defaultdict(list)
+        for (kind, draw_id), group in groups.items():
+            try:
+                results = self.handlers[kind](bot, draws[draw_id], group)
+            except Exception:
+                # the rows will be claimed again when their lease expires
+                logger.exception('Notifications %s for draw %s failed', kind, draw_id)
+                continue
+            for notification in group:
+                result = results.get(notification.id)
+                if result is None:
+                    skipped_ids.append(notification.id)
+                elif isinstance(result, datetime.datetime):
+                    rescheduled[result].append(notification.id)
+                else:
+                    self._sending[notification.id] = result
+        for due_at, notification_ids in rescheduled.items():
+            ScheduledNotification.objects.reschedule(notification_ids, due_at)
+            metrics.incr('notifications.rescheduled', len(notification_ids))
+        if skipped_ids:
+            ScheduledNotification.objects.filter(pk__in=skipped_ids).delete()
+            metrics.incr('notifications.skipped', len(skipped_ids))
+
+    def extend_leases(self):
+        # the outbox may hold rows longer than the lease when it's full, so the lease of
+        # rows waiting there is extended every tick and no poller claims them again
+        sending_ids = list(self._sending)
+        claimed_until = now() + LEASE
+        for start in range(0, len(sending_ids), self.batch_size):
+            ScheduledNotification.objects.extend_claim(sending_ids[start:start + self.batch_size], claimed_until)
+
+    def delete_sent(self):
+        # failed messages are not sent again: the outbox has already retried them
+        sent_ids = [notification_id for notification_id, future in self._sending.items() if future.done()]
+        if not sent_ids:
+            return
+        ScheduledNotification.objects.filter(pk__in=sent_ids).delete()
+        for notification_id in sent_ids:
+            del self._sending[notification_id]
+        metrics.incr('notifications.sent', len(sent_ids))
@@ -0,0 +1,19 @@
+import re
+
+
+ANSWER_SEPARATORS = re.compile(r'[\n+|\r|\(|\)|\.|\,|\:|\;|\"|\[|\]|\s]')
+MIN_WORD_LENGTH = 3
+
+
+def split_answer(text):
+    return [word for word in ANSWER_SEPARATORS.split(text.upper()) if len(word) >= MIN_WORD_LENGTH]
+
+
+def normalize_right_answers(answers):
+    normalized_answers = (answer.strip().upper() for answer in answers)
+    return frozenset(answer for answer in normalized_answers if len(answer) >= MIN_WORD_LENGTH)
+
+
+def is_right_answer(text, right_answers):
+    words = split_answer(text)
+    return len(words) > 0 and len(words) == len(set(words) & right_answers)
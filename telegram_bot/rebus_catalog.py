@@ -0,0 +1,73 @@
+import time
+import threading
+
+from django.conf import settings
+
+from . import metrics
+from .models import Answer, Rebus
+from .rebus_answers import normalize_right_answers
+
+
+class RebusCatalog:
+    # Published rebuses kept in memory. Changes made in this process drop the catalog
+    # through signals, changes made in the admin are picked up after ttl seconds.
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.version = 0
+        self._rebuses = {}
+        self._published_ids = frozenset()
+        self._right_answers = {}
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl
+
+    def load(self):
+        if self.is_fresh():
+            return
+        with self._lock:
+            if self.is_fresh():
+                return
+            rebuses = {rebus.id: rebus for rebus in Rebus.objects.published().prefetch_related('answers')}
+            right_answers = {
+                rebus.id: normalize_right_answers(answer.answer for answer in rebus.answers.all())
+                for rebus in rebuses.values()
+            }
+            self._rebuses, self._published_ids, self._right_answers = rebuses, frozenset(rebuses), right_answers
+            self.version += 1
+            self._loaded_at = time.monotonic()
+        metrics.incr('rebus_catalog.loads')
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def published_ids(self):
+        self.load()
+        return self._published_ids
+
+    def get(self, rebus_id):
+        self.load()
+        rebus = self._rebuses.get(rebus_id)
+        if not rebus:
+            # e.g. a player's current rebus which was unpublished meanwhile
+            rebus = Rebus.objects.filter(pk=rebus_id).first()
+        return rebus
+
+    def get_right_answers(self, rebus_id):
+        self.load()
+        right_answers = self._right_answers.get(rebus_id)
+        if right_answers is None:
+            answers = Answer.objects.filter(rebus_id=rebus_id).values_list('answer', flat=True)
+            right_answers = normalize_right_answers(answers)
+        return right_answers
+
+
+rebus_catalog = RebusCatalog(ttl=settings.REBUS_CATALOG_TTL)
+
+
+def draw_next_rebus(player):
+    rebus_id = player.draw_rebus_id(rebus_catalog.published_ids())
+    player.current_rebus = rebus_id
+    return rebus_catalog.get(rebus_id) if rebus_id else None
@@ -0,0 +1,50 @@
+import io
+import os
+import logging
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from PIL import Image, ImageOps
+
+
+THUMBNAIL_SIZE = (400, 260)  # the admin shows it 130px high, twice as sharp for HiDPI screens
+TELEGRAM_SIZE = (1280, 1280)  # Telegram doesn't show photos larger than that
+JPEG_QUALITY = 85
+
+logger = logging.getLogger(__name__)
+
+
+def make_derivative(image_file, size):
+    # EXIF is not copied, the orientation from it is applied to the pixels instead
+    image_file.seek(0)
+    with Image.open(image_file) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail(size, Image.LANCZOS)
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            image = background
+        elif image.mode != 'RGB':
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+    image_file.seek(0)
+    return ContentFile(output.getvalue())
+
+
+def get_derivative_name(image_name):
+    return f'{os.path.splitext(os.path.basename(image_name))[0]}.jpg'
+
+
+def delete_on_commit(storage, names):
+    # the files are deleted once the rebus pointing to their replacements is saved
+    def delete_files():
+        for name in names:
+            try:
+                storage.delete(name)
+            except Exception:
+                logger.exception('Failed to delete replaced rebus image %s', name)
+
+    if names:
+        transaction.on_commit(delete_files)
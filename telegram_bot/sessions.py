@@ -0,0 +1,123 @@
+import time
+import datetime
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils.timezone import now
+
+from . import metrics
+from .models import Draw, Player, PollResult
+from .rebus_catalog import draw_next_rebus, rebus_catalog
+
+
+# changes committed a bit later than their updated_at, or on a server whose clock is behind, are still seen
+SYNC_OVERLAP = datetime.timedelta(minutes=1)
+
+
+def load_current_rebus(player):
+    current_rebus = rebus_catalog.get(player.current_rebus) if player.current_rebus else None
+    return current_rebus if current_rebus else draw_next_rebus(player)
+
+
+DrawScore = namedtuple('DrawScore', [
+    'draw_id',  # None between draws, the solved rebuses don't count then
+    'solved',
+    'expires_at',  # when the draw ends or the next one starts, None if no draw is planned
+])
+
+
+def load_draw_score(player):
+    # one query finds the current or the next draw and the rebuses solved in it
+    moment = now()
+    draw = Draw.objects.with_solved_by(player).filter(end_at__gte=moment).order_by('start_at').first()
+    if draw and draw.start_at <= moment:
+        return DrawScore(draw.id, draw.solved or 0, draw.end_at)
+    return DrawScore(None, 0, draw.start_at if draw else None)
+
+
+SESSION_STATE_LOADERS = {
+    'draw_score': load_draw_score,
+    'current_rebus': load_current_rebus,
+    'poll': PollResult.objects.active_for_user,
+}
+
+
+class PlayerSession:
+    def __init__(self, player):
+        self.player = player
+        self.loaded_at = time.monotonic()
+        # derived data, each key is loaded with one query when a bot state needs it
+        # and then kept up to date by the handlers which change it
+        self.state = {}
+
+    def load(self, *names):
+        draw_score = self.state.get('draw_score')
+        if draw_score and draw_score.expires_at and now() > draw_score.expires_at:
+            # the solved rebuses of the previous draw don't count in the next one
+            del self.state['draw_score']
+        for name in names:
+            if name not in self.state:
+                self.state[name] = SESSION_STATE_LOADERS[name](self.player)
+
+
+class PlayerSessionCache:
+    # LRU of players the bot talks to. The bot writes only the fields it owns with
+    # update_fields, so a cached row never overwrites admin edits. Players changed by
+    # another process, e.g. in the admin, are found by updated_at every sync interval
+    # and dropped from the cache. A player deleted meanwhile is dropped when the bot
+    # fails to save it.
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._synced_at = now()
+        metrics.register_gauge('player_sessions.size', lambda: len(self._sessions))
+
+    def start(self, job_queue, interval=5):
+        job_queue.run_repeating(lambda context: self.sync(), interval=interval, first=interval, name='player_sessions')
+
+    def get(self, telegram_id):
+        with self._lock:
+            session = self._sessions.get(telegram_id)
+            if session and time.monotonic() - session.loaded_at < self.ttl:
+                self._sessions.move_to_end(telegram_id)
+                metrics.incr('player_sessions.hit')
+                return session
+        metrics.incr('player_sessions.miss')
+        player = Player.objects.register(telegram_id)
+        session = PlayerSession(player)
+        with self._lock:
+            self._sessions[telegram_id] = session
+            self._sessions.move_to_end(telegram_id)
+            while len(self._sessions) > self.maxsize:
+                self._sessions.popitem(last=False)
+                metrics.incr('player_sessions.evicted')
+        return session
+
+    def invalidate(self, telegram_id):
+        with self._lock:
+            self._sessions.pop(telegram_id, None)
+
+    def sync(self):
+        close_old_connections()
+        synced_at = now()
+        changed_players = Player.objects.filter(
+            updated_at__gte=self._synced_at - SYNC_OVERLAP,
+        ).values_list('telegram_id', 'updated_at')
+        with self._lock:
+            for telegram_id, updated_at in changed_players:
+                session = self._sessions.get(telegram_id)
+                # the bot's own writes update the cached instance as well
+                if session and session.player.updated_at != updated_at:
+                    del self._sessions[telegram_id]
+                    metrics.incr('player_sessions.changed')
+        self._synced_at = synced_at
+
+
+player_sessions = PlayerSessionCache(
+    maxsize=settings.PLAYER_SESSION_CACHE_SIZE,
+    ttl=settings.PLAYER_SESSION_CACHE_TTL,
+)
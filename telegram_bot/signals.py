@@ -0,0 +1,42 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Answer, Draw, Player, Rebus, ScheduledNotification
+from .rebus_catalog import rebus_catalog
+from .sessions import player_sessions
+
+
+# the bot saves these fields on the cached instance itself, so they don't make it stale
+BOT_FIELDS = {
+    'full_name', 'phone_number', 'bot_state',
+    'current_competition', 'is_current_rebus_finished', 'current_rebus',
+    'rebus_deck', 'rebus_deck_position', 'rebus_deck_draw', 'updated_at',
+}
+
+
+@receiver(post_save, sender=Player)
+def invalidate_player_session_on_save(sender, instance, update_fields=None, **kwargs):
+    if not instance.telegram_id:
+        return
+    if update_fields is None or not set(update_fields) <= BOT_FIELDS:
+        player_sessions.invalidate(instance.telegram_id)
+
+
+@receiver(post_delete, sender=Player)
+def invalidate_player_session_on_delete(sender, instance, **kwargs):
+    if instance.telegram_id:
+        player_sessions.invalidate(instance.telegram_id)
+
+
+@receiver(post_save, sender=Rebus)
+@receiver(post_delete, sender=Rebus)
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def invalidate_rebus_catalog(sender, **kwargs):
+    rebus_catalog.invalidate()
+
+
+@receiver(post_save, sender=Draw)
+def reschedule_draw_notifications(sender, instance, created, **kwargs):
+    if not created:
+        ScheduledNotification.objects.follow_draw(instance)
@@ -1,3 +1,1304 @@
-from django.test import TestCase # noqa F401
+import os
+import json
+import datetime
+import importlib
+import io
+import queue
+import tempfile
+import time
+import threading
+from concurrent.futures import Future
+from unittest import mock, skipUnless
+from http.client import HTTPConnection
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
-# Create your tests here.
+from django.apps import apps
+from django.conf import settings
+from django.db import connection
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.storage import Storage
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils.timezone import now
+from telegram import Bot, Update
+from telegram.error import RetryAfter
+from telegram.ext import TypeHandler
+from import_export.formats import base_formats
+from PIL import Image
+
+from .management.commands import start_bot as start_bot_command
+from .models import (
+    Answer, Draw, DrawProgress, ExportArtifact, Player, PollQuestion, PollResult, Rebus, RebusAttempt,
+    ScheduledNotification,
+)
+from .admin import PlayerExport, PlayerResources, RebusAttemptAdmin
+from .admin_pagination import EstimatedCountPaginator
+from .error_reporter import ErrorReporter
+from .exports import Export, ExportJobs, export_jobs
+from .notifications import LEASE, NotificationPoller
+from .rebus_answers import is_right_answer, normalize_right_answers
+from .rebus_catalog import rebus_catalog
+from .sessions import DrawScore, PlayerSession, PlayerSessionCache, player_sessions
+from .tg_lib import check_answer, show_rebus, show_temporary_message
+from .tg_dispatcher import ChatLaneDispatcher, get_update_chat_id
+from .tg_outbox import Outbox, OutboundBot
+from .tg_poll import PollDefinition, get_poll_questions, poll_definition
+from .tg_rebus import (
+    MAX_PUZZLES_TO_WIN,
+    TgDialogBot,
+    get_user,
+    notify_draw_ending,
+    handle_auth,
+    handle_poll,
+    handle_rebus,
+    handle_rebus_answer,
+    handle_select,
+    start,
+)
+from .tg_webhook import ListenerUpdater, UpdateQueue, WebhookServer
+from .views import PollResultsExport, iterate_poll_results_csv
+from .write_buffer import WriteBehindBuffer
+
+
+TOKEN = '123:test'
+FORGOTTEN_FILE_ID = 'forgotten-file-id'  # the fake Bot API answers Bad Request to it
+
+
+class FakeBotApiHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        method = self.path.rsplit('/', 1)[-1]
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            payload = {}  # multipart upload of a file
+        self.server.calls.append((method, payload))
+        if payload.get('photo') == FORGOTTEN_FILE_ID:
+            self.respond(400, {'ok': False, 'error_code': 400, 'description': 'Bad Request: wrong file identifier'})
+            return
+        result = True
+        if method in ('sendMessage', 'sendPhoto', 'sendPoll'):
+            result = {
+                'message_id': len(self.server.calls), 'date': 0,
+                'chat': {'id': payload.get('chat_id', 0), 'type': 'private'},
+                'text': payload.get('text', ''),
+            }
+            if method == 'sendPhoto':
+                result['photo'] = [{'file_id': 'file-id', 'file_unique_id': 'u', 'width': 1, 'height': 1}]
+        elif method == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'bot', 'username': 'bot'}
+        self.respond(200, {'ok': True, 'result': result})
+
+    def respond(self, status, body):
+        response = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    do_GET = do_POST
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeBotApi(ThreadingHTTPServer):
+    # Bot API on a local port which answers every request with ok and remembers it
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), FakeBotApiHandler)
+        self.calls = []
+        self.base_url = f'http://127.0.0.1:{self.server_address[1]}/bot'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+    def get_calls(self, method):
+        return [payload for called_method, payload in self.calls if called_method == method]
+
+
+def make_update(update_id, chat_id, text='текст'):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Иван'},
+        },
+    }
+
+
+def wait_for(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return True
+        threading.Event().wait(0.01)
+    return condition()
+
+
+def make_contact_update(update_id, chat_id, phone_number):
+    update = make_update(update_id, chat_id)
+    del update['message']['text']
+    update['message']['contact'] = {'phone_number': phone_number, 'first_name': 'Иван', 'user_id': chat_id}
+    return update
+
+
+def make_poll_answer_update(update_id, chat_id, option_ids):
+    return {
+        'update_id': update_id,
+        'poll_answer': {
+            'poll_id': 'poll', 'option_ids': option_ids,
+            'user': {'id': chat_id, 'is_bot': False, 'first_name': 'Иван'},
+        },
+    }
+
+
+class WebhookTest(SimpleTestCase):
+
+    def setUp(self):
+        self.update_queue = queue.Queue(maxsize=1)
+        self.server = WebhookServer(
+            ('127.0.0.1', 0), Bot(TOKEN), self.update_queue, '/hook', 'secret', enqueue_timeout=0.01,
+        )
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def post(self, body, path='/hook', secret_token='secret'):
+        connection = HTTPConnection(*self.server.server_address)
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret_token} if secret_token else {}
+        connection.request('POST', path, body=body.encode(), headers=headers)
+        status = connection.getresponse().status
+        connection.close()
+        return status
+
+    def test_accepts_update_with_secret_token(self):
+        self.assertEqual(self.post(json.dumps(make_update(1, 10))), 200)
+        update = self.update_queue.get_nowait()
+        self.assertIsInstance(update, Update)
+        self.assertEqual(update.effective_chat.id, 10)
+
+    def test_rejects_update_without_secret_token(self):
+        self.assertEqual(self.post(json.dumps(make_update(1, 10)), secret_token=None), 403)
+        self.assertEqual(self.post(json.dumps(make_update(1, 10)), secret_token='wrong'), 403)
+        self.assertTrue(self.update_queue.empty())
+
+    def test_rejects_unknown_path(self):
+        self.assertEqual(self.post(json.dumps(make_update(1, 10)), path='/other'), 404)
+
+    def test_rejects_body_which_is_not_update(self):
+        for body in ['не json', '[]', '1', 'null']:
+            with self.subTest(body=body):
+                self.assertEqual(self.post(body), 400)
+        self.assertTrue(self.update_queue.empty())
+
+    def test_answers_503_when_queue_is_full(self):
+        self.assertEqual(self.post(json.dumps(make_update(1, 10))), 200)
+        self.assertEqual(self.post(json.dumps(make_update(2, 10))), 503)
+
+    def test_sets_webhook_with_secret_token(self):
+        with FakeBotApi() as api:
+            updater = ListenerUpdater(bot=Bot(TOKEN, base_url=api.base_url), use_context=True)
+            updater.start_listener('127.0.0.1', 0, 'https://bot.example.com/hook', 'secret')
+            updater.stop()
+        [webhook] = api.get_calls('setWebhook')
+        self.assertEqual(webhook['url'], 'https://bot.example.com/hook')
+        self.assertEqual(webhook['secret_token'], 'secret')
+
+
+class ChatLaneDispatcherTest(SimpleTestCase):
+
+    def test_handles_updates_of_chat_in_order(self):
+        handled = []
+        with FakeBotApi() as api:
+            bot = Bot(TOKEN, base_url=api.base_url)
+            dispatcher = ChatLaneDispatcher(bot, UpdateQueue(name='test_updates'), lanes=3, use_context=True)
+            dispatcher.add_handler(TypeHandler(Update, lambda update, context: handled.append(
+                (update.effective_chat.id, update.update_id, threading.current_thread().name)
+            )))
+            thread = threading.Thread(target=dispatcher.start)
+            thread.start()
+            for update_id in range(60):
+                dispatcher.update_queue.put(Update.de_json(make_update(update_id, update_id % 4), bot))
+            for _ in range(500):
+                if len(handled) == 60:
+                    break
+                threading.Event().wait(0.01)
+            dispatcher.stop()
+            thread.join()
+        for chat_id in range(4):
+            chat_updates = [
+                (update_id, lane) for handled_chat_id, update_id, lane in handled if handled_chat_id == chat_id
+            ]
+            self.assertEqual([update_id for update_id, _ in chat_updates], list(range(chat_id, 60, 4)))
+            self.assertEqual({lane for _, lane in chat_updates}, {f'dispatcher_lane_{chat_id % 3}'})
+
+    def test_poll_answer_goes_to_lane_of_user(self):
+        update = Update.de_json({
+            'update_id': 1,
+            'poll_answer': {
+                'poll_id': 'p', 'option_ids': [0],
+                'user': {'id': 42, 'is_bot': False, 'first_name': 'Иван'},
+            },
+        }, Bot(TOKEN))
+        self.assertEqual(get_update_chat_id(update), 42)
+        self.assertIsNone(get_update_chat_id('не обновление'))
+
+
+class OutboxTest(SimpleTestCase):
+
+    def test_sends_messages_of_chat_in_order(self):
+        with FakeBotApi() as api:
+            outbox = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, workers=4)
+            bot = OutboundBot(TOKEN, base_url=api.base_url, outbox=outbox)
+            outbox.start()
+            sent = [bot.send_message(chat_id=chat_id, text=str(number)) for number in range(10) for chat_id in (1, 2)]
+            messages = [future.result(timeout=5) for future in sent]
+            outbox.stop()
+        self.assertEqual([message.text for message in messages[::2]], [str(number) for number in range(10)])
+        for chat_id in (1, 2):
+            texts = [payload['text'] for payload in api.get_calls('sendMessage') if payload['chat_id'] == str(chat_id)]
+            self.assertEqual(texts, [str(number) for number in range(10)])
+
+    def test_delayed_request_waits(self):
+        with FakeBotApi() as api:
+            outbox = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, workers=1)
+            bot = OutboundBot(TOKEN, base_url=api.base_url, outbox=outbox)
+            outbox.start()
+            deleted = bot.delete_message(chat_id=1, message_id=5, delay=0.3)
+            bot.send_message(chat_id=1, text='сразу').result(timeout=5)
+            self.assertFalse(deleted.done())
+            deleted.result(timeout=5)
+            outbox.stop()
+        self.assertEqual([method for method, _ in api.calls], ['sendMessage', 'deleteMessage'])
+
+    def test_temporary_message_is_deleted_later_without_waiting(self):
+        with FakeBotApi() as api:
+            outbox = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, workers=1)
+            bot = OutboundBot(TOKEN, base_url=api.base_url, outbox=outbox)
+            outbox.start()
+            started_at = time.monotonic()
+            show_temporary_message(bot, 1, 'Ребус не найден', lifetime=0.3)
+            self.assertLess(time.monotonic() - started_at, 0.1)
+            self.assertTrue(wait_for(lambda: api.get_calls('deleteMessage')))
+            deleted_at = time.monotonic()
+            outbox.stop()
+        [sent] = api.get_calls('sendMessage')
+        [deleted] = api.get_calls('deleteMessage')
+        self.assertEqual(sent['text'], 'Ребус не найден')
+        self.assertEqual(deleted['message_id'], '1')
+        self.assertGreaterEqual(deleted_at - started_at, 0.3)
+
+    def test_failed_request_fails_its_future(self):
+        errors = []
+        outbox = Outbox(workers=1, on_error=errors.append)
+        outbox.start()
+
+        def send_message():
+            raise RuntimeError('Telegram недоступен')
+
+        future = outbox.put(1, send_message, (), {})
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+        outbox.stop()
+        self.assertEqual(len(errors), 1)
+
+    def test_sends_to_chat_no_faster_than_chat_rate(self):
+        sent_at = {1: [], 2: []}
+        outbox = Outbox(rate=1000, chat_rate=20, chat_burst=1, workers=2)
+        outbox.start()
+        started_at = time.monotonic()
+        sent = [
+            outbox.put(chat_id, lambda chat_id=chat_id: sent_at[chat_id].append(time.monotonic()), (), {})
+            for chat_id in (1, 1, 1, 1, 2)
+        ]
+        for future in sent:
+            future.result(timeout=5)
+        outbox.stop()
+        self.assertGreaterEqual(sent_at[1][-1] - started_at, 3 / 20 * 0.9)
+        self.assertLess(sent_at[2][0] - started_at, 1 / 20)
+
+    def test_waits_retry_after_and_sends_again(self):
+        attempts = []
+
+        def send_message():
+            attempts.append(time.monotonic())
+            if len(attempts) == 1:
+                raise RetryAfter(0.2)
+            return 'отправлено'
+
+        outbox = Outbox(workers=1)
+        outbox.start()
+        self.assertEqual(outbox.put(1, send_message, (), {}).result(timeout=5), 'отправлено')
+        outbox.stop()
+        self.assertGreaterEqual(attempts[1] - attempts[0], 0.2)
+
+
+class DrawScoreTest(TestCase):
+
+    def setUp(self):
+        self.draw = Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        self.next_draw = Draw.objects.create(
+            title='Следующий розыгрыш',
+            start_at=now() + datetime.timedelta(hours=2),
+            end_at=now() + datetime.timedelta(hours=3),
+        )
+        self.player = Player.objects.create(telegram_id=10, created_at=now())
+        DrawProgress.objects.create(player=self.player, draw=self.draw, solved=3)
+
+    def load_draw_score(self, session, moment):
+        with mock.patch(f'{PlayerSession.__module__}.now', return_value=moment):
+            session.load('draw_score')
+        return session.state['draw_score']
+
+    def test_score_is_loaded_again_when_draw_ends_and_next_starts(self):
+        session = PlayerSession(self.player)
+        with self.assertNumQueries(1):
+            self.assertEqual(self.load_draw_score(session, now()), (self.draw.id, 3, self.draw.end_at))
+        between_draws = self.draw.end_at + datetime.timedelta(minutes=30)
+        self.assertEqual(self.load_draw_score(session, between_draws), (None, 0, self.next_draw.start_at))
+        during_next_draw = self.next_draw.start_at + datetime.timedelta(minutes=1)
+        self.assertEqual(
+            self.load_draw_score(session, during_next_draw), (self.next_draw.id, 0, self.next_draw.end_at),
+        )
+        with self.assertNumQueries(0):
+            self.load_draw_score(session, during_next_draw)
+
+    def test_solved_rebus_is_not_counted_between_draws(self):
+        self.draw.delete()
+        rebus = Rebus.objects.create(image='rebus.png', published=True)
+        Answer.objects.create(rebus=rebus, answer='ответ')
+        session = PlayerSession(self.player)
+        session.state['draw_score'] = DrawScore(None, 0, self.next_draw.start_at)
+        user_data = {
+            'user': self.player, 'session': session, 'current_rebus': rebus,
+            'successful_attempts': 0, 'current_rebus_is_guessed': False,
+        }
+        with mock.patch(f'{handle_rebus_answer.__module__}.go_to_next_rebus'):
+            handle_rebus_answer(mock.Mock(), 10, 'ответ', type('Context', (), {'user_data': user_data})())
+        self.assertEqual(session.state['draw_score'].solved, 0)
+
+
+class PlayerSessionCacheTest(TransactionTestCase):
+    # the bot works in autocommit mode, a failed save doesn't break a transaction there
+
+    def setUp(self):
+        self.sessions = PlayerSessionCache(maxsize=10, ttl=300)
+
+    def test_sync_drops_player_changed_by_other_process(self):
+        session = self.sessions.get(10)
+        Player.objects.filter(telegram_id=10).update(full_name='Иван Петров', updated_at=now())
+        self.sessions.sync()
+        new_session = self.sessions.get(10)
+        self.assertIsNot(new_session, session)
+        self.assertEqual(new_session.player.full_name, 'Иван Петров')
+
+    def test_sync_keeps_player_changed_by_bot(self):
+        session = self.sessions.get(10)
+        session.player.full_name = 'Иван Петров'
+        session.player.save_changes()
+        self.sessions.sync()
+        self.assertIs(self.sessions.get(10), session)
+
+    def test_saving_deleted_player_raises_does_not_exist(self):
+        session = self.sessions.get(10)
+        Player.objects.filter(telegram_id=10).delete()
+        session.player.full_name = 'Иван Петров'
+        with self.assertRaises(Player.DoesNotExist):
+            session.player.save_changes()
+
+    def test_bot_drops_session_of_deleted_player(self):
+        def rename_player(update, context):
+            context.user_data['user'].full_name = update.message.text
+            context.user_data['user'].save_changes()
+
+        handler = get_user(rename_player)
+        context = type('Context', (), {'user_data': {}})()
+        self.addCleanup(player_sessions.invalidate, 10)
+        handler(Update.de_json(make_update(1, 10, 'Иван'), Bot(TOKEN)), context)
+        # deleted by another process, which can't invalidate the session of this one
+        with mock.patch.object(player_sessions, 'invalidate'):
+            Player.objects.filter(telegram_id=10).delete()
+        handler(Update.de_json(make_update(2, 10, 'Иван Петров'), Bot(TOKEN)), context)
+        self.assertFalse(Player.objects.filter(telegram_id=10).exists())
+        handler(Update.de_json(make_update(3, 10, 'Иван Петров'), Bot(TOKEN)), context)
+        self.assertEqual(Player.objects.get(telegram_id=10).full_name, 'Иван Петров')
+
+
+class QueryBudgetTest(TestCase):
+    # savepoints are made by the transaction of the test, the bot works in autocommit mode
+    transaction_statements = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+    def setUp(self):
+        Draw.objects.create(title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1),
+                            end_at=now() + datetime.timedelta(hours=1))
+        for number in range(3):
+            rebus = Rebus.objects.create(
+                image=f'rebus_{number}.png', published=True, hint='Подсказка', telegram_file_id=f'file-{number}',
+            )
+            Answer.objects.create(rebus=rebus, answer='ответ')
+        # the poll and the catalog are loaded once per process, not per update
+        poll_definition._mtime = None
+        get_poll_questions()
+        rebus_catalog.invalidate()
+        rebus_catalog.published_ids()
+        self.bot = TgDialogBot(TOKEN, {
+            'START': start,
+            'HANDLE_AUTH': handle_auth,
+            'HANDLE_SELECTIONS': handle_select,
+            'HANDLE_POLL': handle_poll,
+            'HANDLE_REBUS': handle_rebus,
+        })
+        self.handler = get_user(self.bot.handle_users_reply)
+        self.context = type('Context', (), {'bot': self.bot.updater.bot, 'user_data': {}})()
+        self.addCleanup(player_sessions.invalidate, 10)
+
+    def send(self, update):
+        with CaptureQueriesContext(connection) as queries:
+            self.handler(Update.de_json(update, self.context.bot), self.context)
+        return [query['sql'] for query in queries if not query['sql'].startswith(self.transaction_statements)]
+
+    def test_every_state_handler_keeps_to_query_budget(self):
+        conversation = [
+            (make_update(1, 10, '/start'), 'HANDLE_AUTH'),
+            (make_update(2, 10, 'Авторизоваться'), 'HANDLE_AUTH'),
+            (make_contact_update(3, 10, '+79161234567'), 'HANDLE_AUTH'),
+            (make_update(4, 10, 'Иван Петров'), 'HANDLE_SELECTIONS'),
+            (make_update(5, 10, 'Выиграть рюкзак/сумку'), 'HANDLE_REBUS'),
+            (make_update(6, 10, 'Начать игру'), 'HANDLE_REBUS'),
+            (make_update(7, 10, 'не знаю'), 'HANDLE_REBUS'),
+            (make_update(8, 10, '❓ Получить подсказку'), 'HANDLE_REBUS'),
+            (make_update(9, 10, 'Ответ'), 'HANDLE_REBUS'),
+            (make_update(10, 10, f'✅ Продолжить (1 из {MAX_PUZZLES_TO_WIN} успешно)'), 'HANDLE_REBUS'),
+            (make_update(11, 10, '✖ Закончить игру'), 'HANDLE_SELECTIONS'),
+            (make_update(12, 10, 'Выиграть футболку'), 'HANDLE_POLL'),
+            (make_update(13, 10, 'Опрос'), 'HANDLE_POLL'),
+            (make_update(14, 10, 'Москва'), 'HANDLE_POLL'),
+            (make_poll_answer_update(15, 10, [0]), 'HANDLE_POLL'),
+            (make_update(16, 10, '✖ Завершить опрос'), 'HANDLE_SELECTIONS'),
+        ]
+        for update, next_state in conversation:
+            with self.subTest(update_id=update['update_id']):
+                queries = self.send(update)
+                self.assertLessEqual(len(queries), settings.UPDATE_QUERY_BUDGET, '\n'.join(queries))
+                self.assertEqual(Player.objects.get(telegram_id=10).bot_state, next_state)
+        player = Player.objects.get(telegram_id=10)
+        self.assertEqual((player.full_name, player.phone_number), ('Иван Петров', '+79161234567'))
+        self.assertEqual(player.user_attempts.filter(success=True).count(), 1)
+
+
+class PollDefinitionTest(TestCase):
+
+    def setUp(self):
+        poll_file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        poll_file.close()
+        self.addCleanup(os.remove, poll_file.name)
+        self.path = poll_file.name
+
+    def write_poll(self, raw_questions, mtime):
+        with open(self.path, 'w') as file_handler:
+            json.dump(raw_questions, file_handler, ensure_ascii=False)
+        os.utime(self.path, ns=(mtime, mtime))
+
+    def test_compiles_poll_once_until_file_changes(self):
+        self.write_poll([
+            {
+                'question': 'Откуда вы?',
+                'answer options': [{'value': 'Москва', 'next_question': 2}],
+                'poll options': '',
+            },
+            {
+                'question': 'Чем занимаетесь?',
+                'answer options': '',
+                'poll options': [{'value': 'Код', 'next_question': 2}, {'value': 'Дизайн', 'next_question': 2}],
+            },
+        ], mtime=1)
+        definition = PollDefinition(self.path)
+        questions = definition.get_questions()
+        self.assertEqual([question.text for question in questions], ['Откуда вы?', 'Чем занимаетесь?'])
+        self.assertEqual(dict(questions[0].answer_options), {'Москва': 2})
+        self.assertEqual(questions[1].poll_options, (('Код', 2), ('Дизайн', 2)))
+        self.assertEqual(
+            [question.catalog_id for question in questions],
+            list(PollQuestion.objects.values_list('id', flat=True)),
+        )
+        with self.assertNumQueries(0):
+            self.assertIs(definition.get_questions(), questions)
+
+        self.write_poll([{'question': 'Чем занимаетесь?', 'answer options': '', 'poll options': ''}], mtime=2)
+        [question] = definition.get_questions()
+        self.assertEqual(question.catalog_id, questions[1].catalog_id)
+        self.assertEqual(question.poll_options, ())
+
+
+class RebusDeckTest(TestCase):
+
+    def setUp(self):
+        self.player = Player.objects.create(telegram_id=10, created_at=now())
+
+    def test_hands_out_every_published_rebus_once(self):
+        published_ids = frozenset(range(1, 6))
+        drawn_ids = [self.player.draw_rebus_id(published_ids) for _ in range(5)]
+        self.assertEqual(sorted(drawn_ids), list(range(1, 6)))
+        # none was solved, so the player goes through them again
+        self.assertIn(self.player.draw_rebus_id(published_ids), published_ids)
+
+    def test_keeps_rebuses_solved_in_current_draw_out_of_new_deck(self):
+        previous_draw = Draw.objects.create(
+            title='Прошлый розыгрыш',
+            start_at=now() - datetime.timedelta(days=2),
+            end_at=now() - datetime.timedelta(days=1),
+        )
+        Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        rebuses = [Rebus.objects.create(image=f'rebus_{number}.png', published=True) for number in range(3)]
+        for rebus, answered_at in [(rebuses[0], previous_draw.start_at), (rebuses[1], now())]:
+            RebusAttempt.objects.create(
+                rebus=rebus, user=self.player, answer='ответ', success=True,
+                answer_received_at=answered_at, rebus_sendet_at=answered_at,
+            )
+        published_ids = frozenset(rebus.id for rebus in rebuses)
+        drawn_ids = {self.player.draw_rebus_id(published_ids) for _ in range(2)}
+        self.assertEqual(drawn_ids, {rebuses[0].id, rebuses[2].id})
+
+    def test_deals_deck_again_in_next_draw(self):
+        published_ids = frozenset(range(1, 4))
+        first_id = self.player.draw_rebus_id(published_ids)
+        self.assertIsNone(self.player.rebus_deck_draw)
+        draw = Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        drawn_ids = [self.player.draw_rebus_id(published_ids) for _ in range(3)]
+        self.assertEqual(self.player.rebus_deck_draw, draw.id)
+        self.assertEqual(sorted(drawn_ids), [1, 2, 3])
+        self.assertIn(first_id, drawn_ids)
+
+    def test_adds_rebuses_published_later_and_skips_unpublished(self):
+        first_id = self.player.draw_rebus_id(frozenset({1, 2, 3}))
+        unpublished_id = min({1, 2, 3} - {first_id})
+        published_ids = frozenset({1, 2, 3, 4} - {unpublished_id})
+        drawn_ids = {self.player.draw_rebus_id(published_ids) for _ in range(2)}
+        self.assertEqual(drawn_ids, published_ids - {first_id})
+
+
+class RebusAnswerTest(SimpleTestCase):
+
+    def test_checks_every_word_of_answer(self):
+        right_answers = normalize_right_answers([' кот ', 'Собака', 'ок'])
+        self.assertEqual(right_answers, {'КОТ', 'СОБАКА'})
+        self.assertTrue(is_right_answer('Кот', right_answers))
+        self.assertTrue(is_right_answer('кот, собака.', right_answers))
+        self.assertTrue(is_right_answer('кот и собака', right_answers))
+        self.assertFalse(is_right_answer('кот мышь', right_answers))
+        self.assertFalse(is_right_answer('ок', right_answers))
+        self.assertFalse(is_right_answer('', right_answers))
+
+
+class RebusCatalogTest(TestCase):
+
+    def test_checks_answers_from_catalog_without_queries(self):
+        rebus = Rebus.objects.create(image='rebus.png', published=True)
+        Answer.objects.create(rebus=rebus, answer='Кот')
+        rebus_catalog.published_ids()
+        with self.assertNumQueries(0):
+            self.assertTrue(check_answer(rebus.id, 'кот'))
+            self.assertFalse(check_answer(rebus.id, 'пёс'))
+        Answer.objects.create(rebus=rebus, answer='Пёс')
+        self.assertTrue(check_answer(rebus.id, 'пёс'))
+
+
+class RebusImageSendingTest(TransactionTestCase):
+    # the file_id is remembered by the outbox thread, which can't see the transaction of a TestCase
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        with open(os.path.join(media_root.name, 'rebus.png'), 'wb') as image_file:
+            image_file.write(b'image')
+        self.rebus = Rebus.objects.create(image='rebus.png', published=True)
+
+    def show_rebus(self, api, photos_sent, on_error=None):
+        outbox = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, workers=1, on_error=on_error)
+        bot = OutboundBot(TOKEN, base_url=api.base_url, outbox=outbox)
+        outbox.start()
+        show_rebus(bot, 10, self.rebus)
+        wait_for(lambda: len(api.get_calls('sendPhoto')) == photos_sent)
+        outbox.stop()
+
+    def get_file_id(self):
+        return Rebus.objects.get(pk=self.rebus.pk).telegram_file_id
+
+    def test_uploads_image_once_then_sends_file_id(self):
+        with FakeBotApi() as api:
+            self.show_rebus(api, photos_sent=1)
+            self.assertTrue(wait_for(lambda: self.get_file_id() == 'file-id'))
+            self.show_rebus(api, photos_sent=2)
+        [uploaded, sent] = api.get_calls('sendPhoto')
+        self.assertNotIn('photo', uploaded)
+        self.assertEqual(sent['photo'], 'file-id')
+
+    def test_uploads_image_again_when_telegram_forgot_file_id(self):
+        Rebus.objects.filter(pk=self.rebus.pk).update(telegram_file_id=FORGOTTEN_FILE_ID)
+        self.rebus.refresh_from_db()
+        on_error = mock.Mock()
+        with FakeBotApi() as api:
+            self.show_rebus(api, photos_sent=2, on_error=on_error)
+            self.assertTrue(wait_for(lambda: self.get_file_id() == 'file-id'))
+        [forgotten, uploaded] = api.get_calls('sendPhoto')
+        self.assertEqual(forgotten['photo'], FORGOTTEN_FILE_ID)
+        self.assertNotIn('photo', uploaded)
+        on_error.assert_not_called()
+
+    def test_image_is_uploaded_before_messages_sent_after_rebus(self):
+        Rebus.objects.filter(pk=self.rebus.pk).update(telegram_file_id=FORGOTTEN_FILE_ID)
+        self.rebus.refresh_from_db()
+        outbox = Outbox(rate=1000, chat_rate=1000, chat_burst=1000, workers=2)
+        with FakeBotApi() as api:
+            bot = OutboundBot(TOKEN, base_url=api.base_url, outbox=outbox)
+            with mock.patch.object(Storage, 'open') as open_image:
+                show_rebus(bot, 10, self.rebus)
+            # the handler only puts the request into the outbox
+            open_image.assert_not_called()
+            bot.send_message(chat_id=10, text='Верный ответ. Продолжим?')
+            outbox.start()
+            wait_for(lambda: len(api.calls) == 3)
+            outbox.stop()
+        self.assertEqual([method for method, _ in api.calls], ['sendPhoto', 'sendPhoto', 'sendMessage'])
+
+
+class NotificationPollerTest(TransactionTestCase):
+    # the poller closes the connection of its job thread, which would end the transaction of a TestCase
+
+    def setUp(self):
+        self.draw = Draw.objects.create(
+            title='Розыгрыш',
+            start_at=now() - datetime.timedelta(hours=1),
+            end_at=now() + datetime.timedelta(minutes=2),
+        )
+        self.context = type('Context', (), {'bot': None})()
+
+    def test_moving_draw_moves_its_notifications(self):
+        ScheduledNotification.objects.schedule(10, ScheduledNotification.DRAW_FINISHED, self.draw)
+        ScheduledNotification.objects.schedule(10, ScheduledNotification.DRAW_FINISHED, self.draw)
+        self.draw.end_at += datetime.timedelta(hours=1)
+        self.draw.save()
+        [notification] = ScheduledNotification.objects.all()
+        self.assertEqual(notification.due_at, self.draw.end_at)
+
+    def test_sends_reschedules_and_skips_due_notifications(self):
+        for chat_id in (10, 11, 12):
+            ScheduledNotification.objects.schedule(chat_id, ScheduledNotification.DRAW_STARTED, self.draw)
+        ScheduledNotification.objects.schedule(13, ScheduledNotification.DRAW_ENDING, self.draw)
+        sent = Future()
+        later = now() + datetime.timedelta(minutes=1)
+        handled = []
+
+        def notify_started(bot, draw, notifications):
+            handled.extend(notification.chat_id for notification in notifications)
+            results = {notification.chat_id: notification.id for notification in notifications}
+            return {results[10]: sent, results[11]: later}
+
+        poller = NotificationPoller({
+            ScheduledNotification.DRAW_STARTED: notify_started,
+            ScheduledNotification.DRAW_ENDING: lambda bot, draw, notifications: {},
+        })
+        poller.tick(self.context)
+        self.assertEqual(sorted(handled), [10, 11, 12])
+        remaining = dict(ScheduledNotification.objects.values_list('chat_id', 'due_at'))
+        self.assertEqual(remaining, {10: self.draw.start_at, 11: later})
+        # a message in the outbox is not sent again
+        poller.tick(self.context)
+        self.assertEqual(len(handled), 3)
+        sent.set_result(None)
+        poller.tick(self.context)
+        self.assertEqual(list(ScheduledNotification.objects.values_list('chat_id', flat=True)), [11])
+
+    def test_notification_waiting_in_outbox_is_not_claimed_again(self):
+        ScheduledNotification.objects.schedule(10, ScheduledNotification.DRAW_FINISHED, self.draw)
+        Draw.objects.filter(pk=self.draw.pk).update(end_at=now())
+        ScheduledNotification.objects.update(due_at=now())
+        handled = []
+
+        def notify_finished(bot, draw, notifications):
+            handled.extend(notifications)
+            return {notification.id: Future() for notification in notifications}
+
+        handlers = {ScheduledNotification.DRAW_FINISHED: notify_finished}
+        poller, other_poller = NotificationPoller(handlers), NotificationPoller(handlers)
+        poller.tick(self.context)
+        self.assertEqual(len(handled), 1)
+        # the outbox is so full that the message is still there when the lease would expire
+        with mock.patch(f'{NotificationPoller.__module__}.now', return_value=now() + LEASE * 2):
+            poller.tick(self.context)
+            other_poller.tick(self.context)
+        self.assertEqual(len(handled), 1)
+        # the poller is gone, the lease expires and another poller sends the notification
+        with mock.patch(f'{NotificationPoller.__module__}.now', return_value=now() + LEASE * 4):
+            other_poller.tick(self.context)
+        self.assertEqual(len(handled), 2)
+
+    def test_reminders_are_repeated_together(self):
+        ScheduledNotification.objects.schedule(10, ScheduledNotification.DRAW_ENDING, self.draw)
+        ScheduledNotification.objects.schedule(11, ScheduledNotification.DRAW_ENDING, self.draw)
+        bot = mock.Mock()
+        due_at = notify_draw_ending(bot, self.draw, list(ScheduledNotification.objects.all()))
+        self.assertEqual(bot.send_message.call_count, 2)
+        self.assertEqual(len(set(due_at.values())), 1)
+        self.assertGreater(min(due_at.values()), now())
+
+
+class SaveChangesTest(TestCase):
+
+    def test_writes_only_changed_fields_with_one_update(self):
+        Player.objects.create(telegram_id=10, created_at=now())
+        player = Player.objects.get(telegram_id=10)
+        with self.assertNumQueries(0):
+            self.assertEqual(player.save_changes(), [])
+        Player.objects.filter(telegram_id=10).update(phone_number='+79161234567')
+        player.full_name = 'Иван Петров'
+        player.bot_state = 'HANDLE_SELECTIONS'
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(sorted(player.save_changes()), ['bot_state', 'full_name'])
+        [update] = queries
+        self.assertTrue(update['sql'].startswith('UPDATE'))
+        self.assertNotIn('phone_number', update['sql'])
+        with self.assertNumQueries(0):
+            player.save_changes()
+        saved_player = Player.objects.get(telegram_id=10)
+        self.assertEqual(
+            (saved_player.full_name, saved_player.bot_state, saved_player.phone_number),
+            ('Иван Петров', 'HANDLE_SELECTIONS', '+79161234567'),
+        )
+
+
+class WriteBehindBufferTest(TransactionTestCase):
+    # the buffer writes from its own thread, which can't see the transaction of a TestCase
+
+    def setUp(self):
+        self.rebus = Rebus.objects.create(image='rebus.png')
+        self.player = Player.objects.create(telegram_id=10, created_at=now())
+
+    def make_attempt(self, answer):
+        return RebusAttempt(
+            rebus=self.rebus, user=self.player, answer=answer, answer_received_at=now(), rebus_sendet_at=now(),
+        )
+
+    def test_saves_rows_right_away_until_started(self):
+        WriteBehindBuffer().add(self.make_attempt('кот'))
+        self.assertEqual(RebusAttempt.objects.count(), 1)
+
+    def test_writes_rows_added_from_many_threads_once(self):
+        buffer = WriteBehindBuffer(batch_size=50, flush_interval=0.05)
+        buffer.start()
+        self.assertTrue(buffer._thread.daemon)
+
+        def add_attempts(lane):
+            for number in range(100):
+                buffer.add(self.make_attempt(f'{lane}-{number}'))
+
+        threads = [threading.Thread(target=add_attempts, args=(lane,)) for lane in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # the flush thread has taken the full batches, the rest is written on stop
+        self.assertTrue(wait_for(lambda: buffer._size < buffer.batch_size))
+        buffer.stop()
+        answers = list(RebusAttempt.objects.values_list('answer', flat=True))
+        self.assertEqual(sorted(answers), sorted(f'{lane}-{number}' for lane in range(4) for number in range(100)))
+
+
+class StartBotTest(SimpleTestCase):
+
+    def test_stops_everything_when_bot_fails_to_start(self):
+        with mock.patch.object(start_bot_command, 'TgDialogBot') as bot_class, \
+                mock.patch.object(start_bot_command, 'write_buffer') as buffer, \
+                mock.patch.object(start_bot_command, 'error_reporter') as reporter:
+            bot = bot_class.return_value
+            bot.updater.start_polling.side_effect = ConnectionError('Telegram недоступен')
+            with self.assertRaises(ConnectionError):
+                start_bot_command.start_bot()
+        bot.updater.stop.assert_called_once_with()
+        bot.outbox.stop.assert_called_once_with()
+        buffer.stop.assert_called_once_with()
+        reporter.stop.assert_called_once_with()
+
+
+class DrawProgressTest(TestCase):
+
+    def setUp(self):
+        self.draw = Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        self.other_draw = Draw.objects.create(
+            title='Прошлый розыгрыш',
+            start_at=now() - datetime.timedelta(days=2),
+            end_at=now() - datetime.timedelta(days=1),
+        )
+        self.player = Player.objects.create(telegram_id=10, created_at=now())
+        self.rebus = Rebus.objects.create(image='rebus.png', published=True)
+
+    def test_counts_solved_rebuses_per_draw(self):
+        for _ in range(2):
+            Rebus.objects.add_attempt(self.rebus.id, self.player, 'ответ', True, now())
+        Rebus.objects.add_attempt(self.rebus.id, self.player, 'не то', False, now())
+        self.assertEqual(DrawProgress.objects.get_solved(self.player, now()), 2)
+        self.assertEqual(DrawProgress.objects.get_solved(self.player, self.other_draw.start_at), 0)
+
+    def test_migration_builds_progress_of_held_draws(self):
+        RebusAttempt.objects.create(
+            rebus=self.rebus, user=self.player, answer='ответ', success=True,
+            answer_received_at=self.other_draw.start_at, rebus_sendet_at=self.other_draw.start_at,
+        )
+        migration = importlib.import_module('telegram_bot.migrations.0036_auto_20261018_1008')
+        migration.build_draw_progress(apps, None)
+        self.assertEqual(
+            list(DrawProgress.objects.values_list('player', 'draw', 'solved')),
+            [(self.player.id, self.other_draw.id, 1)],
+        )
+
+
+class IndexTest(TestCase):
+
+    def test_hot_queries_use_their_indexes(self):
+        output = io.StringIO()
+        call_command('benchmark', 'explain', stdout=output)
+        self.assertNotIn('не использует индекс', output.getvalue())
+
+
+class PlayerRegistrationTest(TransactionTestCase):
+    # concurrent registrations need connections of their own, outside the transaction of a TestCase
+
+    def test_registers_player_once(self):
+        telegram_id = 2 ** 40  # Telegram ids don't fit into 32 bits
+        player = Player.objects.register(telegram_id)
+        self.assertEqual(Player.objects.register(telegram_id).pk, player.pk)
+        self.assertEqual(Player.objects.filter(telegram_id=telegram_id).count(), 1)
+
+    @skipUnless(connection.vendor == 'postgresql', 'the upsert is made on PostgreSQL only')
+    def test_registers_player_with_one_query(self):
+        with self.assertNumQueries(1):
+            player = Player.objects.register(10)
+        with self.assertNumQueries(1):
+            self.assertEqual(Player.objects.register(10).pk, player.pk)
+
+    @skipUnless(connection.vendor == 'postgresql', 'sqlite locks the whole database for a write')
+    def test_concurrent_first_contacts_make_one_player(self):
+        barrier = threading.Barrier(20)
+        player_ids = []
+
+        def register():
+            barrier.wait()
+            try:
+                player_ids.append(Player.objects.register(10).pk)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=register) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(player_ids), 20)
+        self.assertEqual(set(player_ids), set(Player.objects.filter(telegram_id=10).values_list('pk', flat=True)))
+        self.assertEqual(len(set(player_ids)), 1)
+
+
+class ErrorReporterTest(SimpleTestCase):
+
+    def raise_error(self, reporter):
+        try:
+            raise ValueError('Ребус не найден')
+        except ValueError:
+            reporter.report()
+
+    def test_reports_repeated_error_once_per_window(self):
+        reporter = ErrorReporter(window=0.2)
+        with mock.patch(f'{ErrorReporter.__module__}.rollbar') as rollbar:
+            reporter.start()
+            for _ in range(3):
+                self.raise_error(reporter)
+            threading.Event().wait(0.2)
+            self.raise_error(reporter)
+            reporter.stop()
+        first_report, second_report = rollbar.report_exc_info.call_args_list
+        self.assertIsNone(first_report.kwargs['extra_data'])
+        self.assertEqual(second_report.kwargs['extra_data'], {'skipped_repeats': 2})
+
+    def test_handler_does_not_wait_for_rollbar(self):
+        reporter = ErrorReporter(queue_size=1)
+        sending = threading.Event()
+        with mock.patch(f'{ErrorReporter.__module__}.rollbar') as rollbar:
+            rollbar.report_exc_info.side_effect = lambda *args, **kwargs: sending.wait(5)
+            reporter.start()
+            started_at = time.monotonic()
+            for error in [ValueError(), KeyError(), TypeError()]:
+                reporter.report((type(error), error, None))
+            self.assertLess(time.monotonic() - started_at, 0.1)
+            sending.set()
+            reporter.stop()
+        self.assertLess(rollbar.report_exc_info.call_count, 3)
+
+
+class PollResultsCsvTest(TestCase):
+
+    def setUp(self):
+        self.city, self.company = [
+            PollQuestion.objects.get(pk=question_id)
+            for question_id in PollQuestion.objects.sync(['Ваш город', 'Ваша компания'])
+        ]
+
+    def add_poll(self, full_name, answers, exclude_from_export=False, finished=True):
+        player = Player.objects.create(
+            telegram_id=Player.objects.count() + 1, full_name=full_name, phone_number='+79161234567',
+            exclude_from_export=exclude_from_export, created_at=now(),
+        )
+        poll = PollResult.objects.create(user=player, poll_finished=finished, started_at=now(), ended_at=now())
+        for question, answer in answers:
+            PollResult.objects.add_question_answer_pair(poll.id, question.id, answer, now())
+
+    def test_streams_one_line_per_finished_poll_with_two_queries(self):
+        self.add_poll('Иван', [(self.city, 'Москва'), (self.company, 'ООО "Ромашка"')])
+        self.add_poll('Пётр', [(self.company, 'ИП')])
+        self.add_poll('Скрытый', [(self.city, 'Казань')], exclude_from_export=True)
+        self.add_poll('Незаконченный', [(self.city, 'Омск')], finished=False)
+        with self.assertNumQueries(2):
+            csv_text = ''.join(iterate_poll_results_csv())
+        self.assertEqual(csv_text, (
+            'Имя и фамилия,Номер телефона,Ваш город,Ваша компания\n'
+            'Иван,+79161234567,Москва,"ООО ""Ромашка"""\n'
+            'Пётр,+79161234567,,ИП\n'
+        ))
+
+
+class PollQuestionCatalogTest(TestCase):
+
+    def test_keeps_ids_of_questions_when_poll_changes(self):
+        city_id, company_id = PollQuestion.objects.sync(['Ваш город', 'Ваша компания'])
+        question_ids = PollQuestion.objects.sync(['Ваша компания', 'Ваш город?', 'Должность'])
+        self.assertEqual(question_ids[:2], [company_id, city_id])
+        self.assertEqual(
+            list(PollQuestion.objects.values_list('text', flat=True)),
+            ['Ваша компания', 'Ваш город?', 'Должность'],
+        )
+
+    def test_keeps_questions_removed_from_poll(self):
+        city_id, company_id = PollQuestion.objects.sync(['Ваш город', 'Ваша компания'])
+        self.assertEqual(PollQuestion.objects.sync(['Ваша компания']), [company_id])
+        self.assertTrue(PollQuestion.objects.filter(pk=city_id).exists())
+
+    def test_questions_with_same_slug_cannot_be_in_one_poll(self):
+        with self.assertRaises(ValueError):
+            PollQuestion.objects.sync(['Ваш город', 'ваш город?'])
+        self.assertFalse(PollQuestion.objects.exists())
+
+    def test_long_questions_with_same_beginning_are_told_apart(self):
+        beginning = 'Какой ' * 30
+        question_ids = PollQuestion.objects.sync([f'{beginning}город?', f'{beginning}язык?'])
+        self.assertEqual(len(set(question_ids)), 2)
+        self.assertEqual(PollQuestion.objects.sync([f'{beginning}город']), question_ids[:1])
+
+
+class ExportWatermarkTest(TestCase):
+
+    def setUp(self):
+        self.player = Player.objects.create(
+            telegram_id=1, full_name='Иван', phone_number='+79161234567', created_at=now(),
+        )
+        self.question_id, = PollQuestion.objects.sync(['Ваш город'])
+        self.poll = PollResult.objects.create(user=self.player, poll_finished=True, started_at=now(), ended_at=now())
+
+    def make_player_export(self):
+        return PlayerExport(PlayerResources(), Player.objects.all(), base_formats.CSV(), params='format=csv')
+
+    def assert_watermarks_change(self, change):
+        player_watermark = self.make_player_export().get_watermark()
+        poll_watermark = PollResultsExport().get_watermark()
+        change()
+        self.assertNotEqual(self.make_player_export().get_watermark(), player_watermark)
+        self.assertNotEqual(PollResultsExport().get_watermark(), poll_watermark)
+
+    def test_edit_of_player_changes_watermarks(self):
+        self.player.full_name = 'Иван Петров'
+        self.assert_watermarks_change(self.player.save)
+
+    def test_excluding_player_changes_watermarks(self):
+        self.player.exclude_from_export = True
+        self.assert_watermarks_change(self.player.save)
+
+    def test_answer_written_after_poll_finished_changes_watermark(self):
+        watermark = PollResultsExport().get_watermark()
+        PollResult.objects.add_question_answer_pair(self.poll.id, self.question_id, 'Москва', now())
+        self.assertNotEqual(PollResultsExport().get_watermark(), watermark)
+
+    def test_renamed_question_changes_watermark(self):
+        watermark = PollResultsExport().get_watermark()
+        PollQuestion.objects.sync(['Ваш город?'])
+        self.assertNotEqual(PollResultsExport().get_watermark(), watermark)
+
+    def test_export_in_progress_is_returned_without_watermark(self):
+        jobs = ExportJobs()
+        jobs._executor = mock.Mock()
+        artifact = jobs.request(PollResultsExport())
+        with mock.patch.object(PollResultsExport, 'get_watermark') as get_watermark:
+            self.assertEqual(jobs.request(PollResultsExport()).pk, artifact.pk)
+        get_watermark.assert_not_called()
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_poll_results_page_redirects_to_artifact(self):
+        with mock.patch.object(export_jobs, '_executor'):
+            response = self.client.get('/poll/file.csv')
+        artifact = ExportArtifact.objects.get(kind=PollResultsExport.kind)
+        self.assertRedirects(response, f'/poll/file/{artifact.id}/', target_status_code=202)
+
+    def test_export_with_long_filters_is_found_by_params_hash(self):
+        jobs = ExportJobs()
+        jobs._executor = mock.Mock()
+        export = PlayerExport(PlayerResources(), Player.objects.all(), base_formats.CSV(), params='q=' + 'и' * 2000)
+        artifact = jobs.request(export)
+        self.assertEqual(jobs.request(export).pk, artifact.pk)
+        self.assertEqual(ExportArtifact.objects.get().params, export.params)
+
+    def test_export_without_watermark_cannot_be_created(self):
+        class IncompleteExport(Export):
+            kind = 'incomplete'
+
+            def get_filename(self, version):
+                return 'incomplete.csv'
+
+            def write(self, output, report_progress):
+                pass
+
+        with self.assertRaises(TypeError):
+            IncompleteExport()
+
+    def test_finished_artifact_is_reused_until_watermark_changes(self):
+        jobs = ExportJobs()
+        jobs._executor = mock.Mock()
+        artifact = jobs.request(self.make_player_export())
+        ExportArtifact.objects.filter(pk=artifact.pk).update(status=ExportArtifact.DONE)
+        self.assertEqual(jobs.request(self.make_player_export()).pk, artifact.pk)
+        self.player.full_name = 'Иван Петров'
+        self.player.save()
+        self.assertEqual(jobs.request(self.make_player_export()).version, 2)
+        self.assertEqual(jobs._executor.submit.call_count, 2)
+
+
+@override_settings(
+    MAX_PUZZLES_TO_WIN=2, STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class DrawWinnersTest(TestCase):
+
+    def setUp(self):
+        self.draw = Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        self.other_draw = Draw.objects.create(
+            title='Прошлый розыгрыш',
+            start_at=now() - datetime.timedelta(days=2),
+            end_at=now() - datetime.timedelta(days=1),
+        )
+        self.winner, self.other_winner, self.player = [
+            Player.objects.create(telegram_id=telegram_id, full_name=f'Участник {telegram_id}', created_at=now())
+            for telegram_id in range(1, 4)
+        ]
+        DrawProgress.objects.bulk_create([
+            DrawProgress(player=self.winner, draw=self.draw, solved=2),
+            DrawProgress(player=self.player, draw=self.draw, solved=1),
+            DrawProgress(player=self.other_winner, draw=self.other_draw, solved=3),
+        ])
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_winners_are_selected_per_draw(self):
+        self.assertEqual(list(Player.objects.winners_of(self.draw.id)), [self.winner])
+        self.assertEqual(
+            dict(Draw.objects.with_winners_count().values_list('title', 'winners_count')),
+            {'Розыгрыш': 1, 'Прошлый розыгрыш': 1},
+        )
+
+    def test_draw_changelist_counts_winners_without_query_per_draw(self):
+        changelist_url = reverse('admin:telegram_bot_draw_changelist')
+        self.client.get(changelist_url)  # warms up the caches of the admin
+        with CaptureQueriesContext(connection) as two_draws_queries:
+            self.client.get(changelist_url)
+        Draw.objects.create(title='Будущий розыгрыш', start_at=now(), end_at=now() + datetime.timedelta(days=1))
+        with CaptureQueriesContext(connection) as three_draws_queries:
+            response = self.client.get(changelist_url)
+        self.assertEqual(len(three_draws_queries), len(two_draws_queries))
+        self.assertEqual(
+            {draw.title: draw.winners_count for draw in response.context['cl'].result_list},
+            {'Розыгрыш': 1, 'Прошлый розыгрыш': 1, 'Будущий розыгрыш': 0},
+        )
+
+    def test_player_changelist_filters_winners_of_draw(self):
+        response = self.client.get(reverse('admin:telegram_bot_player_changelist'), {'draw': self.draw.id})
+        self.assertEqual(list(response.context['cl'].result_list), [self.winner])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class RebusAttemptAdminTest(TestCase):
+
+    def setUp(self):
+        self.draw = Draw.objects.create(
+            title='Розыгрыш', start_at=now() - datetime.timedelta(hours=1), end_at=now() + datetime.timedelta(hours=1),
+        )
+        self.player = Player.objects.create(telegram_id=1, full_name='Иван', created_at=now())
+        self.rebus = Rebus.objects.create(image='rebus.png', published=True)
+        Answer.objects.create(rebus=self.rebus, answer='Ответ')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def add_attempts(self, count, received_at):
+        RebusAttempt.objects.bulk_create([
+            RebusAttempt(
+                rebus=self.rebus, user=self.player, answer='ответ', success=True,
+                answer_received_at=received_at, rebus_sendet_at=received_at,
+            )
+            for _ in range(count)
+        ])
+
+    def test_changelist_makes_same_queries_for_any_number_of_attempts(self):
+        changelist_url = reverse('admin:telegram_bot_rebusattempt_changelist')
+        self.add_attempts(1, now())
+        self.client.get(changelist_url)  # warms up the caches of the admin
+        with CaptureQueriesContext(connection) as one_attempt_queries:
+            self.client.get(changelist_url)
+        self.add_attempts(20, now())
+        self.add_attempts(1, now() - datetime.timedelta(days=1))
+        with CaptureQueriesContext(connection) as many_attempts_queries:
+            response = self.client.get(changelist_url)
+        self.assertEqual(len(many_attempts_queries), len(one_attempt_queries))
+        model_admin = response.context['cl'].model_admin
+        attempts = response.context['cl'].result_list
+        self.assertEqual(len(attempts), 22)
+        self.assertEqual([model_admin.get_draw(attempt) for attempt in attempts], ['Розыгрыш'] * 21 + ['-'])
+        self.assertEqual(model_admin.get_right_answers(attempts[0]), ['Ответ'])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class KeysetPaginationTest(TestCase):
+
+    def setUp(self):
+        player = Player.objects.create(telegram_id=1, created_at=now())
+        rebus = Rebus.objects.create(image='rebus.png', published=True)
+        received_at = now()
+        RebusAttempt.objects.bulk_create([
+            RebusAttempt(rebus=rebus, user=player, answer=str(number), answer_received_at=answer_received_at)
+            for number, answer_received_at in enumerate([
+                received_at, None, received_at - datetime.timedelta(minutes=1), received_at, None,
+                received_at - datetime.timedelta(minutes=2), received_at,
+            ])
+        ])
+        self.changelist_url = reverse('admin:telegram_bot_rebusattempt_changelist')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    @mock.patch.object(RebusAttemptAdmin, 'list_per_page', 2)
+    def test_next_pages_continue_after_last_row_shown(self):
+        pages = []
+        next_page_url = ''
+        while next_page_url is not None and len(pages) < 10:
+            response = self.client.get(f'{self.changelist_url}{next_page_url}')
+            pages.append([attempt.id for attempt in response.context['cl'].result_list])
+            next_page_url = response.context['cl'].get_next_page_url()
+        expected_ids = list(RebusAttempt.objects.order_by('-answer_received_at', '-pk').values_list('id', flat=True))
+        self.assertEqual(pages, [expected_ids[:2], expected_ids[2:4], expected_ids[4:6], expected_ids[6:]])
+
+    def test_broken_cursor_resets_changelist(self):
+        response = self.client.get(self.changelist_url, {'after': 'вчера|1'})
+        self.assertRedirects(response, f'{self.changelist_url}?e=1', fetch_redirect_response=False)
+
+    def test_large_count_is_estimated(self):
+        paginator = EstimatedCountPaginator(RebusAttempt.objects.all(), 2, exact_count_limit=5)
+        with mock.patch(f'{EstimatedCountPaginator.__module__}.estimate_count', return_value=2):
+            self.assertEqual(paginator.count, 7)
+            self.assertFalse(paginator.count_is_estimated)
+        paginator = EstimatedCountPaginator(RebusAttempt.objects.all(), 2, exact_count_limit=5)
+        with mock.patch(f'{EstimatedCountPaginator.__module__}.estimate_count', return_value=50000):
+            self.assertEqual(paginator.count, 50000)
+            self.assertTrue(paginator.count_is_estimated)
+
+
+class RebusImagesTest(TransactionTestCase):
+    # the replaced copies are deleted on commit, which never comes in a TestCase
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_image(self, mode, size, image_format, **save_kwargs):
+        output = io.BytesIO()
+        Image.new(mode, size).save(output, image_format, **save_kwargs)
+        return ContentFile(output.getvalue(), name=f'rebus.{image_format.lower()}')
+
+    def open_image(self, image_field):
+        image_field.open('rb')
+        self.addCleanup(image_field.close)
+        image = Image.open(image_field)
+        image.load()
+        return image
+
+    def test_upload_builds_derivatives_with_exif_orientation_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # the camera was turned, the image has to be rotated 90 degrees clockwise
+        rebus = Rebus.objects.create(image=self.make_image('RGB', (3000, 2000), 'JPEG', exif=exif))
+        thumbnail = self.open_image(rebus.thumbnail)
+        telegram_image = self.open_image(rebus.telegram_image)
+        self.assertEqual(thumbnail.size, (173, 260))
+        self.assertEqual(telegram_image.size, (853, 1280))
+        self.assertEqual(telegram_image.format, 'JPEG')
+        self.assertFalse(telegram_image.getexif())
+
+    def test_transparent_image_gets_white_background(self):
+        rebus = Rebus.objects.create(image=self.make_image('RGBA', (100, 100), 'PNG'))
+        telegram_image = self.open_image(rebus.telegram_image)
+        self.assertEqual((telegram_image.mode, telegram_image.size), ('RGB', (100, 100)))
+        self.assertEqual(telegram_image.getpixel((50, 50)), (255, 255, 255))
+
+    def test_command_builds_missing_derivatives(self):
+        rebus = Rebus.objects.create(image=self.make_image('RGB', (600, 400), 'PNG'))
+        Rebus.objects.filter(pk=rebus.pk).update(thumbnail='', telegram_image='')
+        call_command('build_rebus_images', stdout=io.StringIO())
+        rebus.refresh_from_db()
+        self.assertEqual(self.open_image(rebus.thumbnail).size, (390, 260))
+        self.assertEqual(self.open_image(rebus.telegram_image).size, (600, 400))
+
+    def test_replacing_image_deletes_previous_copies(self):
+        rebus = Rebus.objects.create(image=self.make_image('RGB', (600, 400), 'PNG'))
+        previous_files = [rebus.thumbnail.name, rebus.telegram_image.name]
+        rebus.image = self.make_image('RGB', (300, 200), 'PNG')
+        rebus.save()
+        storage = rebus.thumbnail.storage
+        self.assertEqual([storage.exists(name) for name in previous_files], [False, False])
+        self.assertTrue(storage.exists(rebus.thumbnail.name))
+        self.assertTrue(storage.exists(rebus.telegram_image.name))
+        self.assertNotIn(rebus.thumbnail.name, previous_files)
+
+    def test_command_rebuilding_copies_deletes_previous_ones(self):
+        rebus = Rebus.objects.create(image=self.make_image('RGB', (600, 400), 'PNG'))
+        previous_files = [rebus.thumbnail.name, rebus.telegram_image.name]
+        call_command('build_rebus_images', '--all', stdout=io.StringIO())
+        rebus.refresh_from_db()
+        storage = rebus.thumbnail.storage
+        self.assertEqual([storage.exists(name) for name in previous_files], [False, False])
+        self.assertTrue(storage.exists(rebus.thumbnail.name))
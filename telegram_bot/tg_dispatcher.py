@@ -0,0 +1,75 @@
+import time
+from threading import Thread
+
+from django.db import close_old_connections, connection
+from telegram import Update
+from telegram.ext import Dispatcher
+
+from . import metrics
+from .tg_webhook import UpdateQueue
+
+
+STOP_LANE = object()
+
+
+def get_update_chat_id(update):
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat:
+        return update.effective_chat.id
+    if update.effective_user:
+        # poll answers come without a chat, in private chats user id is the chat id
+        return update.effective_user.id
+
+
+class ChatLaneDispatcher(Dispatcher):
+    # Updates of one chat always go to the same lane and are handled strictly in order,
+    # different chats are spread over lanes and handled in parallel
+    def __init__(self, *args, lanes=4, lane_queue_size=0, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lanes = [
+            UpdateQueue(lane_queue_size, name=f'dispatcher_lane_{number}')
+            for number in range(lanes)
+        ]
+        self.lane_threads = []
+        self.busy_lanes = set()
+        metrics.register_gauge('dispatcher.busy_lanes', lambda: len(self.busy_lanes))
+
+    def start(self, ready=None):
+        if not self.lane_threads:
+            self.lane_threads = [
+                Thread(target=self.handle_lane, args=(lane,), name=lane.name)
+                for lane in self.lanes
+            ]
+            for thread in self.lane_threads:
+                thread.start()
+        super().start(ready)
+
+    def stop(self):
+        super().stop()
+        for lane in self.lanes:
+            lane.put(STOP_LANE)
+        for thread in self.lane_threads:
+            thread.join()
+        self.lane_threads = []
+
+    def process_update(self, update):
+        chat_id = get_update_chat_id(update)
+        if chat_id is None:
+            return super().process_update(update)
+        self.lanes[chat_id % len(self.lanes)].put(update)
+
+    def handle_lane(self, lane):
+        while True:
+            update = lane.get()
+            if update is STOP_LANE:
+                break
+            close_old_connections()
+            started_at = time.monotonic()
+            self.busy_lanes.add(lane.name)
+            try:
+                super().process_update(update)
+            finally:
+                self.busy_lanes.discard(lane.name)
+                metrics.observe('dispatcher.update', time.monotonic() - started_at)
+        connection.close()
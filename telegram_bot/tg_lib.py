@@ -1,31 +1,30 @@
-import re
-import json
 import textwrap
-from os import path #FIXME Временное решения
 
 import telegram.ext
-import requests
 
 from telegram import (
+    Bot,
+    InputFile,
     ReplyKeyboardMarkup,
     KeyboardButton
 )
+from telegram.error import BadRequest
 
 from django.utils.timezone import now
 
-from .models import Draw, Rebus
+from . import metrics
+from .models import Draw
+from .rebus_answers import is_right_answer
+from .rebus_catalog import rebus_catalog
+from .tg_outbox import PRIORITY_ANSWER
+from .tg_poll import get_poll_questions
 
 
 TYPE_COMPETITION = {'is_rebus': 'РЕБУС', 'is_poll': 'ОПРОС'}
 
 
-def check_answer(chat_id, answer, context):
-    rebus = Rebus.objects.get(pk=context.user_data['current_rebus'].id)
-    answers = rebus.answers.all()
-    regex_object = re.compile(r'[\n+|\r|\(|\)|\.|\,|\:|\;|\"|\[|\]|\s]')
-    answer_seq = [word for word in regex_object.split(answer.upper()) if len(word) > 2]
-    correct_answer_seq = [word for word in [item.answer.upper() for item in answers] if len(word) > 2]
-    return len(answer_seq) == len(set(answer_seq) & set(correct_answer_seq)) and len(answer_seq) > 0
+def check_answer(rebus_id, answer):
+    return is_right_answer(answer, rebus_catalog.get_right_answers(rebus_id))
 
 
 def show_rebus_start_keyboard(bot, chat_id, context, max_puzzles):
@@ -72,20 +71,28 @@ def show_rebus(bot, chat_id, current_rebus, description=''):
         [['❓ Получить подсказку'], ['✖ Закончить игру']],
         one_time_keyboard=False, row_width=1, resize_keyboard=True
     )
-    
-    if requests.get(current_rebus.image.url).ok:
-        # for production server
-        bot.send_photo(
-            chat_id=chat_id, photo=image.url, reply_markup=reply_markup,
-            caption=' '.join([item for item in (current_rebus.text, description) if item])
-        )
-    else:
-        # for localhost
-        with open(current_rebus.image.path, 'rb') as image:
-            bot.send_photo(
-                chat_id=chat_id, photo=image, reply_markup=reply_markup,
-                caption=' '.join([item for item in (current_rebus.text, description) if item])
-            )
+    caption = ' '.join([item for item in (current_rebus.text, description) if item])
+    # one outbox request, so even an upload comes before the messages sent after the rebus
+    return bot.enqueue(send_rebus_photo, (bot,), {
+        'chat_id': chat_id, 'rebus': current_rebus, 'reply_markup': reply_markup, 'caption': caption,
+    })
+
+
+def send_rebus_photo(bot, chat_id, rebus, **kwargs):
+    # Runs in the outbox thread, where Bot.send_photo sends right away. The image is read
+    # from the storage and uploaded only if Telegram has no file_id of it
+    if rebus.telegram_file_id:
+        try:
+            return Bot.send_photo(bot, chat_id=chat_id, photo=rebus.telegram_file_id, **kwargs)
+        except BadRequest:
+            # Telegram forgot the file, it's uploaded again
+            metrics.incr('rebus_images.forgotten_file_id')
+            rebus.telegram_file_id = ''
+    image = rebus.telegram_image or rebus.image
+    with image.storage.open(image.name, 'rb') as image_file:
+        sent = Bot.send_photo(bot, chat_id=chat_id, photo=InputFile(image_file), **kwargs)
+    rebus.remember_telegram_file_id(sent.photo[-1].file_id)
+    return sent
 
 
 def show_hint(bot, chat_id, current_rebus, description=''):
@@ -112,12 +119,12 @@ def go_to_next_rebus(bot, chat_id, description, context, max_puzzles):
     bot.send_message(chat_id=chat_id, text=description, reply_markup=reply_markup)
 
 
-def show_end_message(bot, chat_id, text_message, remove_keyboard=True):
+def show_end_message(bot, chat_id, text_message, remove_keyboard=True, priority=PRIORITY_ANSWER):
     if remove_keyboard:
-        bot.send_message(chat_id=chat_id, text=text_message)
+        return bot.send_message(chat_id=chat_id, text=text_message, priority=priority)
     else:
-        bot.send_message(
-            chat_id=chat_id, text=text_message,
+        return bot.send_message(
+            chat_id=chat_id, text=text_message, priority=priority,
             reply_markup=ReplyKeyboardMarkup(
                 [['Игра закончена']], one_time_keyboard=False,
                 row_width=1, resize_keyboard=True
@@ -139,6 +146,16 @@ def delete_messages(bot, chat_id, message_id, message_numbers=1):
         bot.delete_message(chat_id=chat_id, message_id=int(message_id) - offset_id)
 
 
+def show_temporary_message(bot, chat_id, text_message, lifetime=10):
+    # the message is deleted by the outbox after lifetime seconds, nobody waits for it
+
+    def delete_later(sent):
+        if not sent.exception():
+            bot.delete_message(chat_id=chat_id, message_id=sent.result().message_id, delay=lifetime)
+
+    bot.send_message(chat_id=chat_id, text=text_message).add_done_callback(delete_later)
+
+
 def show_auth_keyboard(bot, chat_id):
     message = textwrap.dedent('''
         Перед началом использования необходимо отправить номер телефона.
@@ -179,33 +196,17 @@ def show_select_competition_keyboard(bot, chat_id, text_message):
     return bot.send_message(chat_id=chat_id, text=text_message, reply_markup=reply_markup)
 
 
-def show_next_question(bot, chat_id, question_number, context):
-    user_data = context.user_data
-    questions = user_data['poll_questions']
-    message = questions[question_number]
-    answer_options = message['answer options']
-    poll_options = message['poll options']
-    reply_markup = ReplyKeyboardMarkup(
-        [['✖ Завершить опрос']],
-        one_time_keyboard=False, row_width=1,
-        resize_keyboard=True
-    )
-    if poll_options:
-        message = bot.send_poll(
-            chat_id, message['question'],
-            [item['value'] for item in poll_options],
+def show_next_question(bot, chat_id, question_number):
+    question = get_poll_questions()[question_number]
+    if question.poll_options:
+        bot.send_poll(
+            chat_id, question.text,
+            [value for value, _ in question.poll_options],
             is_anonymous=False, allows_multiple_answers=True,
-            reply_markup=reply_markup
+            reply_markup=question.reply_markup
         )
-    elif answer_options:
-        reply_markup = ReplyKeyboardMarkup(
-            [[item['value'] for item in answer_options]],
-            one_time_keyboard=False, row_width=1,
-            resize_keyboard=True
-        )
-        bot.send_message(chat_id=chat_id, text=message['question'], reply_markup=reply_markup)
     else:
-        bot.send_message(chat_id=chat_id, text=message['question'], reply_markup=reply_markup)
+        bot.send_message(chat_id=chat_id, text=question.text, reply_markup=question.reply_markup)
 
 
 def show_end_poll_message(bot, chat_id):
@@ -214,12 +215,6 @@ def show_end_poll_message(bot, chat_id):
     bot.send_message(chat_id=chat_id, text=message, reply_markup=telegram.ReplyKeyboardRemove())
 
 
-def read_poll_questions():
-    with open('questions_to_clients.txt', 'r') as file_handler:
-        poll_questions = json.load(file_handler)
-    return poll_questions
-
-
 def check_draws(current_competition):
     if current_competition == TYPE_COMPETITION['is_rebus']:
         return Draw.objects.get_draw()
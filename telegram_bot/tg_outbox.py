@@ -0,0 +1,271 @@
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+from django.db import close_old_connections, connection
+from telegram import Bot
+from telegram.error import BadRequest, NetworkError, RetryAfter, TimedOut
+
+from . import metrics
+
+
+PRIORITY_ANSWER = 0
+PRIORITY_NOTIFICATION = 1
+
+MAX_NETWORK_RETRIES = 3
+PRUNE_INTERVAL = 60  # seconds
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def refill(self, moment):
+        self.tokens = min(self.burst, self.tokens + (moment - self.updated_at) * self.rate)
+        self.updated_at = moment
+
+    def get_delay(self, moment):
+        self.refill(moment)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, moment):
+        self.refill(moment)
+        self.tokens -= 1
+
+    def is_full(self, moment):
+        self.refill(moment)
+        return self.tokens >= self.burst
+
+
+class OutgoingRequest:
+    def __init__(self, method, args, kwargs, priority):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.priority = priority
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+        self.retries = 0
+
+
+class ChatOutbox:
+    def __init__(self, bucket):
+        self.bucket = bucket
+        self.requests = deque()
+        self.busy = False
+        self.not_before = 0
+
+
+class Outbox:
+    # Requests to one chat are sent strictly in order, one at a time and no faster than
+    # the per chat limit. Chats whose next request may go out now wait in the ready heap
+    # ordered by priority, chats which have to wait for their limit or a RetryAfter wait
+    # in the delayed heap. All senders share the global limit. Requests put with a delay
+    # wait in the scheduled heap and join their chat queue when the delay is over.
+    def __init__(self, rate=30, chat_rate=1, chat_burst=3, workers=8, on_error=None):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.on_error = on_error
+        self._bucket = TokenBucket(rate, 1)
+        self._chats = {}
+        self._ready = []  # (priority, sequence number, chat_id)
+        self._delayed = []  # (time to send at, sequence number, chat_id)
+        self._scheduled = []  # (time to enqueue at, sequence number, chat_id, request)
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._pending = 0
+        self._pruned_at = time.monotonic()
+        self._running = False
+        self._threads = []
+        metrics.register_gauge('outbox.pending', lambda: self._pending)
+        metrics.register_gauge('outbox.chats', lambda: len(self._chats))
+        metrics.register_gauge('outbox.scheduled', lambda: len(self._scheduled))
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        self._threads = [
+            threading.Thread(target=self.send_requests, name=f'outbox_{number}', daemon=True)
+            for number in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=10):
+        # requests enqueued before the stop are still sent
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        deadline = time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        if self._pending:
+            logger.warning('Outbox stopped with %s unsent requests', self._pending)
+        self._threads = []
+
+    def put(self, chat_id, method, args, kwargs, priority=PRIORITY_ANSWER, delay=0):
+        request = OutgoingRequest(method, args, kwargs, priority)
+        with self._condition:
+            if delay > 0:
+                heapq.heappush(self._scheduled, (time.monotonic() + delay, next(self._sequence), chat_id, request))
+            else:
+                self._append(chat_id, request, time.monotonic())
+            self._condition.notify()
+        return request.future
+
+    def _append(self, chat_id, request, moment):
+        request.enqueued_at = moment
+        chat = self._chats.get(chat_id)
+        if not chat:
+            chat = self._chats[chat_id] = ChatOutbox(TokenBucket(self.chat_rate, self.chat_burst))
+        chat.requests.append(request)
+        self._pending += 1
+        if len(chat.requests) == 1 and not chat.busy:
+            self._schedule(chat_id, chat, moment)
+
+    def _schedule(self, chat_id, chat, moment):
+        delay = max(chat.bucket.get_delay(moment), chat.not_before - moment)
+        if delay > 0:
+            heapq.heappush(self._delayed, (moment + delay, next(self._sequence), chat_id))
+        else:
+            heapq.heappush(self._ready, (chat.requests[0].priority, next(self._sequence), chat_id))
+
+    def _prune(self, moment):
+        self._pruned_at = moment
+        idle_chat_ids = [
+            chat_id for chat_id, chat in self._chats.items()
+            if not chat.requests and not chat.busy and chat.not_before <= moment and chat.bucket.is_full(moment)
+        ]
+        for chat_id in idle_chat_ids:
+            del self._chats[chat_id]
+
+    def _take(self):
+        with self._condition:
+            while True:
+                moment = time.monotonic()
+                # on stop the scheduled requests are sent right away
+                while self._scheduled and (self._scheduled[0][0] <= moment or not self._running):
+                    _, _, chat_id, request = heapq.heappop(self._scheduled)
+                    self._append(chat_id, request, moment)
+                if not self._running and not self._pending:
+                    return None, None, None
+                if moment - self._pruned_at > PRUNE_INTERVAL:
+                    self._prune(moment)
+                while self._delayed and self._delayed[0][0] <= moment:
+                    _, _, chat_id = heapq.heappop(self._delayed)
+                    chat = self._chats[chat_id]
+                    heapq.heappush(self._ready, (chat.requests[0].priority, next(self._sequence), chat_id))
+                if self._ready:
+                    timeout = self._bucket.get_delay(moment)
+                    if not timeout:
+                        _, _, chat_id = heapq.heappop(self._ready)
+                        chat = self._chats[chat_id]
+                        self._bucket.take(moment)
+                        chat.bucket.take(moment)
+                        chat.busy = True
+                        return chat_id, chat, chat.requests.popleft()
+                else:
+                    timeout = self._delayed[0][0] - moment if self._delayed else None
+                if self._scheduled:
+                    scheduled_timeout = self._scheduled[0][0] - moment
+                    timeout = scheduled_timeout if timeout is None else min(timeout, scheduled_timeout)
+                self._condition.wait(timeout)
+
+    def _release(self, chat_id, chat, retry=None, not_before=0):
+        with self._condition:
+            chat.busy = False
+            if retry:
+                chat.requests.appendleft(retry)
+                chat.not_before = not_before
+            else:
+                self._pending -= 1
+            if chat.requests:
+                self._schedule(chat_id, chat, time.monotonic())
+            self._condition.notify()
+
+    def send_requests(self):
+        while True:
+            chat_id, chat, request = self._take()
+            if not request:
+                break
+            close_old_connections()
+            self.send(chat_id, chat, request)
+        connection.close()
+
+    def send(self, chat_id, chat, request):
+        started_at = time.monotonic()
+        metrics.observe('outbox.wait', started_at - request.enqueued_at)
+        try:
+            result = request.method(*request.args, **request.kwargs)
+        except RetryAfter as error:
+            metrics.incr('outbox.retry_after')
+            self._release(chat_id, chat, retry=request, not_before=time.monotonic() + error.retry_after)
+            return
+        except (BadRequest, TimedOut) as error:
+            # the request is wrong or may have been delivered already, retrying won't help
+            self._release(chat_id, chat)
+            self.fail(request, error)
+            return
+        except NetworkError as error:
+            if request.retries < MAX_NETWORK_RETRIES:
+                request.retries += 1
+                metrics.incr('outbox.retried')
+                self._release(chat_id, chat, retry=request, not_before=time.monotonic() + 2 ** request.retries)
+            else:
+                self._release(chat_id, chat)
+                self.fail(request, error)
+            return
+        except Exception as error:
+            self._release(chat_id, chat)
+            self.fail(request, error)
+            return
+        self._release(chat_id, chat)
+        metrics.incr('outbox.sent')
+        metrics.observe('outbox.send', time.monotonic() - started_at)
+        request.future.set_result(result)
+
+    def fail(self, request, error):
+        metrics.incr('outbox.failed')
+        logger.warning('Telegram request %s failed: %r', request.method.__name__, error)
+        if self.on_error:
+            self.on_error(error)
+        request.future.set_exception(error)
+
+
+class OutboundBot(Bot):
+    # Sending methods only put the request into the outbox and return a Future
+    # of its result, so handlers never wait for Telegram. A delay in seconds postpones
+    # the request without blocking anyone, e.g. to delete a message later.
+    def __init__(self, *args, outbox, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.outbox = outbox
+
+    def enqueue(self, method, args, kwargs):
+        priority = kwargs.pop('priority', PRIORITY_ANSWER)
+        delay = kwargs.pop('delay', 0)
+        chat_id = kwargs['chat_id'] if 'chat_id' in kwargs else args[0]
+        return self.outbox.put(chat_id, method, args, kwargs, priority, delay)
+
+    def send_message(self, *args, **kwargs):
+        return self.enqueue(super().send_message, args, kwargs)
+
+    def send_photo(self, *args, **kwargs):
+        return self.enqueue(super().send_photo, args, kwargs)
+
+    def send_poll(self, *args, **kwargs):
+        return self.enqueue(super().send_poll, args, kwargs)
+
+    def delete_message(self, *args, **kwargs):
+        return self.enqueue(super().delete_message, args, kwargs)
@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+from telegram import ReplyKeyboardMarkup
+
+from .models import PollQuestion
+
+
+CompiledQuestion = namedtuple('CompiledQuestion', [
+    'number',
+    'text',
+    'answer_options',  # {answer text: next question number}
+    'poll_options',  # ((option text, next question number), ...) in the order Telegram shows them
+    'reply_markup',
+    'catalog_id',  # id of the PollQuestion the answers refer to
+])
+
+
+def build_question_keyboard(answer_options):
+    if answer_options:
+        keyboard = [list(answer_options)]
+    else:
+        keyboard = [['✖ Завершить опрос']]
+    return ReplyKeyboardMarkup(keyboard, one_time_keyboard=False, row_width=1, resize_keyboard=True)
+
+
+def compile_poll(raw_questions):
+    questions = []
+    for number, raw_question in enumerate(raw_questions):
+        answer_options = MappingProxyType({
+            option['value']: option['next_question'] for option in raw_question['answer options'] or []
+        })
+        poll_options = tuple(
+            (option['value'], option['next_question']) for option in raw_question['poll options'] or []
+        )
+        questions.append(CompiledQuestion(
+            number=number,
+            text=raw_question['question'],
+            answer_options=answer_options,
+            poll_options=poll_options,
+            reply_markup=build_question_keyboard(answer_options),
+            catalog_id=None,
+        ))
+    return tuple(questions)
+
+
+class PollDefinition:
+    # The poll is compiled once and shared by all users, it's recompiled only when
+    # the file on disk changes
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._questions = ()
+
+    def get_questions(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    with open(self.path, 'r') as file_handler:
+                        questions = compile_poll(json.load(file_handler))
+                    catalog_ids = PollQuestion.objects.sync([question.text for question in questions])
+                    self._questions = tuple(
+                        question._replace(catalog_id=catalog_id)
+                        for question, catalog_id in zip(questions, catalog_ids)
+                    )
+                    self._mtime = mtime
+        return self._questions
+
+
+poll_definition = PollDefinition(settings.POLL_QUESTIONS_FILE)
+
+
+def get_poll_questions():
+    return poll_definition.get_questions()
@@ -1,24 +1,26 @@
-import os
-import time
-import rollbar
+import datetime
+import logging
 import textwrap
 import phonenumbers
 import telegram.ext
 
+from django.conf import settings
+from django.db import connection
 from django.utils.timezone import now
 
 from telegram import ReplyKeyboardMarkup
+from telegram.utils.request import Request
 
 from telegram.ext import (
     CallbackQueryHandler,
     PollAnswerHandler,
     CommandHandler,
     Filters,
-    MessageHandler,
-    Updater
+    JobQueue,
+    MessageHandler
     )
 
-from .models import Player, Rebus, PollResult, RebusAttempt
+from .models import Draw, DrawProgress, Player, PollResult, Rebus, ScheduledNotification
 
 from .tg_lib import (
     check_answer,
@@ -28,7 +30,6 @@ from .tg_lib import (
     get_message_of_waiting_to_start_draw,
     get_message_of_waiting_to_end_draw,
     go_to_next_rebus,
-    read_poll_questions,
     show_auth_keyboard,
     show_rebus_start_keyboard,
     show_poll_start_keyboard,
@@ -39,31 +40,100 @@ from .tg_lib import (
     show_select_competition_keyboard,
     show_next_question,
     show_end_poll_message,
+    show_temporary_message,
     show_message_about_draw_status
     )
+from . import metrics
+from .rebus_catalog import draw_next_rebus
+from .sessions import player_sessions
+from .tg_poll import get_poll_questions
+from .tg_dispatcher import ChatLaneDispatcher, get_update_chat_id
+from .tg_webhook import ListenerUpdater, UpdateQueue
+from .tg_outbox import Outbox, OutboundBot, PRIORITY_NOTIFICATION
+from .notifications import NotificationPoller
+from .write_buffer import write_buffer
+from .error_reporter import error_reporter
+
+
+MAX_PUZZLES_TO_WIN = settings.MAX_PUZZLES_TO_WIN
+TYPE_COMPETITION = {'is_rebus': 'РЕБУС', 'is_poll': 'ОПРОС'}
+REMINDER_INTERVAL = datetime.timedelta(minutes=1)
 
+# session data every bot state handler needs, everything else is not loaded at all
+STATES_SESSION_DATA = {
+    'HANDLE_SELECTIONS': ['draw_score'],
+    'HANDLE_REBUS': ['draw_score', 'current_rebus'],
+    'HANDLE_POLL': ['poll'],
+}
 
-rollbar.init(os.getenv('ROLLBAR_TOKEN'))
+logger = logging.getLogger(__name__)
 
-MAX_PUZZLES_TO_WIN = os.getenv('MAX_PUZZLES_TO_WIN', 10)
-TYPE_COMPETITION = {'is_rebus': 'РЕБУС', 'is_poll': 'ОПРОС'}
+
+def report_send_error(error):
+    error_reporter.report((type(error), error, error.__traceback__))
+
+
+def count_write(name, changed_fields):
+    if changed_fields:
+        metrics.incr(f'writes.{name}')
+        metrics.incr(f'writes.{name}_fields', len(changed_fields))
+    else:
+        metrics.incr(f'writes.{name}_skipped')
 
 
 def get_user(func):
     def wrapper(update, context):
-        chat_id = update.message.chat_id
-        user, _ = Player.objects.get_or_create(telegram_id=chat_id)
-        context.user_data['user'] = user
-        return func(update, context)
+        query_counter = metrics.QueryCounter()
+        with connection.execute_wrapper(query_counter):
+            chat_id = get_update_chat_id(update)
+            session = player_sessions.get(chat_id)
+            context.user_data['user'] = session.player
+            context.user_data['session'] = session
+            try:
+                result = func(update, context)
+            except Player.DoesNotExist:
+                # the player was deleted in the admin, the next update registers the chat again
+                player_sessions.invalidate(chat_id)
+                logger.info('Player %s was deleted while the bot was talking to it', chat_id)
+                return None
+            except Exception:
+                # the session may be half updated, the next update reads the player from the database
+                player_sessions.invalidate(chat_id)
+                raise
+        metrics.observe('update.queries', query_counter.count)
+        if query_counter.count > settings.UPDATE_QUERY_BUDGET:
+            metrics.incr('update.query_budget_exceeded')
+            logger.warning(
+                'Update in state %s made %s queries, budget is %s',
+                session.player.bot_state, query_counter.count, settings.UPDATE_QUERY_BUDGET
+            )
+        return result
     return wrapper
 
 
 class TgDialogBot(object):
 
-    def __init__(self, tg_token, states_functions):
+    def __init__(self, tg_token, states_functions, base_url=None, workers=4, lanes=4, update_queue_size=0,
+                 send_rate=30, chat_send_rate=1, chat_send_burst=3, send_workers=8,
+                 notification_interval=5, notification_batch_size=500, session_sync_interval=5):
         self.tg_token = tg_token
         self.states_functions = states_functions
-        self.updater = Updater(token=tg_token, use_context=True)
+        self.outbox = Outbox(
+            rate=send_rate, chat_rate=chat_send_rate, chat_burst=chat_send_burst,
+            workers=send_workers, on_error=report_send_error,
+        )
+        bot = OutboundBot(
+            tg_token, base_url=base_url, outbox=self.outbox,
+            request=Request(con_pool_size=workers + lanes + send_workers + 4),
+        )
+        job_queue = JobQueue()
+        dispatcher = ChatLaneDispatcher(
+            bot, UpdateQueue(update_queue_size), job_queue=job_queue,
+            workers=workers, use_context=True,
+            lanes=lanes, lane_queue_size=update_queue_size // lanes,
+        )
+        job_queue.set_dispatcher(dispatcher)
+        self.updater = ListenerUpdater(dispatcher=dispatcher, workers=None, use_context=True)
         self.updater.dispatcher.add_handler(CommandHandler('start', get_user(self.handle_users_reply)))
         self.updater.dispatcher.add_handler(CommandHandler('help', self.help_handler))
         self.updater.dispatcher.add_handler(CallbackQueryHandler(get_user(self.handle_users_reply)))
@@ -71,6 +141,16 @@ class TgDialogBot(object):
         self.updater.dispatcher.add_handler(PollAnswerHandler(get_user(self.handle_users_reply)))
         self.updater.dispatcher.add_error_handler(self.error)
         self.job_queue = self.updater.job_queue
+        self.notifications = NotificationPoller(
+            {
+                ScheduledNotification.DRAW_STARTED: notify_draw_started,
+                ScheduledNotification.DRAW_ENDING: notify_draw_ending,
+                ScheduledNotification.DRAW_FINISHED: notify_draw_finished,
+            },
+            interval=notification_interval, batch_size=notification_batch_size,
+        )
+        self.notifications.start(self.job_queue)
+        player_sessions.start(self.job_queue, interval=session_sync_interval)
 
     def handle_users_reply(self, update, context):
         user = context.user_data['user']
@@ -86,16 +166,13 @@ class TgDialogBot(object):
         else:
             return
 
-        if not context.bot_data.get('job_queue'):
-            context.bot_data.update({'job_queue': self.job_queue})
-
         if user_reply == '/start':
             user_state = 'START'
             context.user_data.update({
                 'chat_id': chat_id, 'current_rebus_is_guessed': False,
                 'current_rebus': '', 'successful_attempts': 0,
                 'current_question': 0, 'current_competition': '',
-                'poll_id': 0, 'poll_questions': ''
+                'poll_id': 0
                 })
         else:
 
@@ -104,16 +181,15 @@ class TgDialogBot(object):
             user_state = user_state if user_state else 'HANDLE_AUTH'
 
         state_handler = self.states_functions[user_state]
-        next_state = state_handler(context.bot, update, context)
+        user.bot_state = state_handler(context.bot, update, context)
         self.save_user_data(chat_id, context)
-        user.bot_state = next_state
-        user.save()
 
     def error(self, update, context):
         if isinstance(context.error, FileNotFoundError):
             handle_error_poll_not_found(context.bot, update.effective_chat.id)
         else:
-            rollbar.report_exc_info()
+            error = context.error
+            error_reporter.report((type(error), error, error.__traceback__))
 
     def help_handler(self, update, context):
         update.message.reply_text("Используйте /start для того, что бы перезапустить бот")
@@ -121,23 +197,29 @@ class TgDialogBot(object):
     def update_user_data(self, chat_id, context):
         user_data = context.user_data
         user = user_data['user']
-        amount_rebus_success_attempts = RebusAttempt.objects.get_amount_rebus_seccusses_attempts(user)
-        current_rebus = user.get_current_rebus()
+        session = user_data['session']
+        session.load(*STATES_SESSION_DATA.get(user.bot_state, []))
+        poll = session.state.get('poll')
         user_data['chat_id'] = chat_id
         user_data['current_competition'] = user.current_competition
         user_data['current_rebus_is_guessed'] = user.is_current_rebus_finished
-        user_data['successful_attempts'] = amount_rebus_success_attempts
-        user_data['current_rebus'] = current_rebus if current_rebus else Rebus.objects.fresh(user).next()
-        user_data['current_question'] = PollResult.objects.get_current_question_by_user(user)
-        user_data['poll_id'] = PollResult.objects.get_poll_id(user)
-        user_data['poll_questions'] = read_poll_questions()
+        draw_score = session.state.get('draw_score')
+        user_data['successful_attempts'] = draw_score.solved if draw_score else 0
+        user_data['current_rebus'] = session.state.get('current_rebus')
+        user_data['current_question'] = poll.current_question if poll else 0
+        user_data['poll_id'] = poll.id if poll else 0
 
     def save_user_data(self, chat_id, context):
+        # everything the handlers changed is written with at most one UPDATE per row
         user_data = context.user_data
         user = user_data['user']
-        user.change_current_competition(user_data['current_competition'])
-        user.change_current_rebus_finished(user_data['current_rebus_is_guessed'])
-        PollResult.objects.save_current_question(user, user_data['current_question'])
+        user.current_competition = user_data['current_competition']
+        user.is_current_rebus_finished = user_data['current_rebus_is_guessed']
+        count_write('player', user.save_changes())
+        poll = user_data['session'].state.get('poll')
+        if poll:
+            poll.current_question = user_data['current_question']
+            count_write('poll', poll.save_changes())
 
 
 def start(bot, update, context):
@@ -155,7 +237,6 @@ def handle_auth(bot, update, context):
         phone_number = update.message.contact.phone_number
         if phone_number and phonenumbers.is_valid_number(phonenumbers.parse(phone_number, 'RU')):
             user.phone_number = phone_number
-            user.save()
             bot.send_message(
                 chat_id=chat_id,
                 text=f'Введите Ваше Имя и Фамилию:',
@@ -175,7 +256,6 @@ def handle_auth(bot, update, context):
             return 'HANDLE_AUTH'
         else:
             user.full_name = update.message.text
-            user.save()
             show_select_competition_keyboard(bot, update.message.chat_id, 'Выберите конкурс:')
             return 'HANDLE_SELECTIONS'
 
@@ -186,7 +266,6 @@ def handle_select(bot, update, context):
     user_data = context.user_data
     user = user_data['user']
     chat_id = update.message.chat_id
-    draws = check_draws(TYPE_COMPETITION['is_rebus'])
     if 'Выиграть футболку' in update.message.text:
         user_data['current_competition'] = TYPE_COMPETITION['is_poll']
         show_poll_start_keyboard(bot, chat_id, user.is_finished_poll())
@@ -199,10 +278,7 @@ def handle_select(bot, update, context):
             show_rebus_start_keyboard(bot, chat_id, context, MAX_PUZZLES_TO_WIN)
             return 'HANDLE_REBUS'
         elif draws and rest_time_to_draw:
-            start_jobs(
-                chat_id, send_message_for_start_draw, context, once=True,
-                start_at=draws.start_at, name='send_message_for_start_draw'
-                )
+            ScheduledNotification.objects.schedule(chat_id, ScheduledNotification.DRAW_STARTED, draws)
             rest_hours_to_draw, rest_minutes_to_draw = rest_time_to_draw
             show_select_competition_keyboard(
                 bot, chat_id,
@@ -255,11 +331,15 @@ def start_rebus(bot, chat_id, context):
     user = user_data['user']
     current_rebus = user_data['current_rebus']
     if current_rebus and user_data['successful_attempts'] < int(MAX_PUZZLES_TO_WIN):
-        start_jobs(chat_id, show_rebus_reminder, context, name='show_rebus_reminder')
+        draw = Draw.objects.get_current_draw().first()
+        if draw:
+            ScheduledNotification.objects.schedule(chat_id, ScheduledNotification.DRAW_ENDING, draw)
+            ScheduledNotification.objects.schedule(chat_id, ScheduledNotification.DRAW_FINISHED, draw)
         user_data['current_rebus_is_guessed'] = False
         help_message = 'ℹ️ Отгадайте и введите слово на картинке. Если затрудняетесь, нажмите "Получить подсказку" ℹ️'
         show_rebus(bot, chat_id, current_rebus, help_message)
-        user.change_current_rebus(current_rebus.id)
+        user.current_rebus = current_rebus.id
+        user_data['session'].state['current_rebus'] = current_rebus
         return 'HANDLE_REBUS'
     elif current_rebus and user_data['successful_attempts'] == int(MAX_PUZZLES_TO_WIN):
         show_message_about_draw_status(bot, chat_id)
@@ -277,22 +357,24 @@ def go_next_rebus(bot, chat_id, context):
             Поздравляем. Подойдите на стенд ⬛⬛⬛⬛⬛, покажите данное сообщение и примите
             участие в розыгрыше рюкзака/сумки 🎁''')
         return finish_rebus(bot, chat_id, context, message)
-    elif user_data['successful_attempts'] == Rebus.objects.count():
+    next_rebus = draw_next_rebus(user)
+    if not next_rebus:
         message = textwrap.dedent(f'''
             Отсутствуют доступные ребусы.
             Спасибо за участие в игре 👏
             Вы угадали {user_data['successful_attempts']} из {MAX_PUZZLES_TO_WIN} ребусов''')
         return finish_rebus(bot, chat_id, context, message)
-    else:
-        user_data['current_rebus'] = Rebus.objects.fresh(user).next()
-        show_rebus(bot, chat_id, user_data['current_rebus'])
-        user.change_current_rebus(user_data['current_rebus'].id)
+    user_data['current_rebus'] = next_rebus
+    show_rebus(bot, chat_id, next_rebus)
+    user_data['session'].state['current_rebus'] = next_rebus
     return 'HANDLE_REBUS'
 
 
 def finish_rebus(bot, chat_id, context, text_message):
     show_end_message(bot, chat_id, text_message)
-    stop_jobs(chat_id, context, name='show_rebus_reminder')
+    ScheduledNotification.objects.cancel(
+        chat_id, ScheduledNotification.DRAW_ENDING, ScheduledNotification.DRAW_FINISHED
+    )
     return handle_end_competition(bot, chat_id, context)
 
 
@@ -320,9 +402,13 @@ def handle_rebus_answer(bot, chat_id, answer, context):
             Поздравляем. Подойдите на стенд ⬛⬛⬛⬛⬛, покажите данное сообщение и примите
             участие в розыгрыше рюкзака/сумки 🎁''')
         return finish_rebus(bot, chat_id, context, message)
-    if check_answer(chat_id, answer, context):
+    if check_answer(user_data['current_rebus'].id, answer):
         user_data['current_rebus_is_guessed'] = True
         Rebus.objects.add_attempt(user_data['current_rebus'].id, user, answer, True, now())
+        draw_score = user_data['session'].state['draw_score']
+        if draw_score.draw_id:
+            # add_attempt counts the rebus only during a draw
+            user_data['session'].state['draw_score'] = draw_score._replace(solved=draw_score.solved + 1)
         go_to_next_rebus(bot, chat_id, 'Верный ответ. Продолжим?', context, MAX_PUZZLES_TO_WIN)
         return 'HANDLE_REBUS'
     elif not user_data['current_rebus_is_guessed']:
@@ -342,134 +428,154 @@ def handle_rebus_answer(bot, chat_id, answer, context):
 
 def handle_poll_answer(bot, chat_id, answer, context):
     user_data = context.user_data
+    start_poll(context)
     question_number = user_data['current_question']
-    message = user_data['poll_questions'][question_number - 1]
-    PollResult.objects.add_question_answer_pair(
-        user_data['poll_id'],
-        question_number, message['question'],
-        answer, now()
-    )
-    next_question = [item['next_question'] for item in message['answer options'] if item['value'] == answer]
-    if next_question:
-        return next_question[0]
+    question = get_poll_questions()[question_number - 1]
+    PollResult.objects.add_question_answer_pair(user_data['poll_id'], question.catalog_id, answer, now())
+    return question.answer_options.get(answer)
 
 
 def handle_poll_messages(bot, update, context):
     user_data = context.user_data
-    user = user_data['user']
     chat_id = update.message.chat_id
     question_number = user_data['current_question']
 
     if update.message.text == 'Опрос' or\
             update.message.text == 'Пройти опрос заново':
-        show_next_question(bot, chat_id, question_number, context)
+        start_poll(context)
+        question_number = user_data['current_question']
+        show_next_question(bot, chat_id, question_number)
         user_data['current_question'] = question_number + 1
         return 'HANDLE_POLL'
 
     if 'Завершить опрос' in update.message.text or\
             'Отказаться от опроса' in update.message.text:
-        PollResult.objects.del_unfinished_poll(user)
+        poll = user_data['session'].state.get('poll')
+        if poll:
+            # answers of the poll must reach the database before it's deleted
+            write_buffer.flush()
+            poll.delete()
+        user_data['session'].state['poll'] = None
         return handle_end_competition(bot, chat_id, context)
 
     current_question_number = handle_answers(bot, chat_id, update.message.text, context)
     question_number = current_question_number if current_question_number else question_number
 
-    if question_number == len(user_data['poll_questions']):
+    if question_number == len(get_poll_questions()):
         show_end_poll_message(bot, chat_id)
-        PollResult.objects.finish_poll(user, question_number, True)
+        poll = user_data['session'].state.get('poll')
+        if poll:
+            poll.finish(question_number)
+        user_data['session'].state['poll'] = None
         return handle_end_competition(bot, chat_id, context)
 
     else:
-        show_next_question(bot, chat_id, question_number, context)
+        show_next_question(bot, chat_id, question_number)
         user_data['current_question'] = question_number + 1
         return 'HANDLE_POLL'
 
 
+def start_poll(context):
+    user_data = context.user_data
+    session = user_data['session']
+    if not session.state.get('poll'):
+        session.state['poll'] = PollResult.objects.start(user_data['user'])
+    user_data['poll_id'] = session.state['poll'].id
+    user_data['current_question'] = session.state['poll'].current_question
+
+
 def handle_poll_answers(bot, update, context):
     user_data = context.user_data
+    start_poll(context)
     chat_id = update.poll_answer.user.id
     question_number = user_data['current_question']
-    current_message = user_data['poll_questions'][question_number - 1]
-    answers = [item for id, item in enumerate(current_message['poll options']) if id in update.poll_answer.option_ids]
+    current_question = get_poll_questions()[question_number - 1]
+    answers = [
+        option for option_id, option in enumerate(current_question.poll_options)
+        if option_id in update.poll_answer.option_ids
+    ]
     if answers:
-        question_number = sorted(answers, key=lambda x: x['next_question'])[0]['next_question']
-        string_answers = ' | '.join([item['value'] for item in answers])
+        question_number = min(next_question for _, next_question in answers)
+        string_answers = ' | '.join([value for value, _ in answers])
         PollResult.objects.add_question_answer_pair(
-            user_data['poll_id'],
-            question_number, current_message['question'],
-            string_answers, now()
+            user_data['poll_id'], current_question.catalog_id, string_answers, now()
         )
     else:
         question_number, string_answers = question_number + 1, ''
-    show_next_question(bot, chat_id, question_number, context)
+    show_next_question(bot, chat_id, question_number)
     user_data['current_question'] = question_number + 1
     return 'HANDLE_POLL'
 
 
 def handle_error_poll_not_found(bot, chat_id):
-    message = bot.send_message(chat_id=chat_id, text=f'🚫 Не обнаружен файл с опросами или картинка ребуса!')
-    time.sleep(10)
-    bot.delete_message(chat_id=chat_id, message_id=message.message_id)
-    user = Player.objects.get(telegram_id=chat_id)
+    show_temporary_message(bot, chat_id, '🚫 Не обнаружен файл с опросами или картинка ребуса!')
+    user = player_sessions.get(chat_id).player
     user.bot_state = 'HANDLE_SELECTIONS'
-    user.save()
+    user.save_changes()
 
 
 def handle_error_rebus_not_found(bot, chat_id):
-    message = bot.send_message(chat_id=chat_id, text=f'🚫 Отсутствуют доступные ребусы!')
-    time.sleep(10)
-    bot.delete_message(chat_id=chat_id, message_id=message.message_id)
+    show_temporary_message(bot, chat_id, '🚫 Отсутствуют доступные ребусы!')
 
 
-def start_jobs(chat_id, job, context, once=False, **kwargs):
-    user_data = context.user_data
-    job_name = f'{chat_id}_{kwargs["name"]}'
-    if not context.bot_data['job_queue'].get_jobs_by_name(job_name):
-        if once:
-            context.bot_data['job_queue'].run_once(
-                job, when=kwargs['start_at'],
-                name=job_name, context=user_data
-            )
-        else:
-            context.bot_data['job_queue'].run_repeating(
-                job, interval=60, first=0,
-                name=job_name, context=user_data
-            )
+def show_rebus_reminder(bot, chat_id, rest_time_to_end_draw):
+    rest_hours_to_draw, rest_minutes_to_draw = rest_time_to_end_draw
+    return bot.send_message(
+        chat_id=chat_id,
+        text=get_message_of_waiting_to_end_draw(rest_hours_to_draw, rest_minutes_to_draw),
+        priority=PRIORITY_NOTIFICATION
+    )
 
 
-def stop_jobs(chat_id, context, **kwargs):
-    job_name = f'{chat_id}_{kwargs["name"]}'
-    found_job = context.bot_data['job_queue'].get_jobs_by_name(job_name)
-    found_job[0].schedule_removal() if found_job else True
+def show_draw_finished(bot, chat_id, successful_attempts):
+    message = textwrap.dedent(f'''
+        Спасибо за участие в игре 👏
+        Вы угадали {successful_attempts} из {MAX_PUZZLES_TO_WIN} ребусов''')
+    return show_end_message(bot, chat_id, message, remove_keyboard=False, priority=PRIORITY_NOTIFICATION)
+
+
+def notify_draw_started(bot, draw, notifications):
+    if now() < draw.start_at:
+        # the draw was moved to a later time
+        return {notification.id: draw.start_at for notification in notifications}
+    if now() > draw.end_at:
+        return {}
+    # only players who are still waiting for the draw are notified
+    waiting_chat_ids = set(Player.objects.filter(
+        telegram_id__in=[notification.chat_id for notification in notifications],
+        current_competition=TYPE_COMPETITION['is_rebus'],
+    ).values_list('telegram_id', flat=True))
+    return {
+        notification.id: bot.send_message(
+            chat_id=notification.chat_id,
+            text=f'👌 Розыгрыш рюкзака/сумки начался. Вы можете принять участие.',
+            priority=PRIORITY_NOTIFICATION
+        )
+        for notification in notifications if notification.chat_id in waiting_chat_ids
+    }
 
 
-def show_rebus_reminder(context):
-    chat_id = context.job.context['chat_id']
-    draws = check_draws(TYPE_COMPETITION['is_rebus'])
-    rest_time_to_end_draw = get_rest_time_to_end_draw(draws)
-    if draws and rest_time_to_end_draw:
-        rest_hours_to_draw, rest_minutes_to_draw = rest_time_to_end_draw
-        if not rest_hours_to_draw and rest_minutes_to_draw <= 5:
-            context.bot.send_message(
-                chat_id=chat_id,
-                text=get_message_of_waiting_to_end_draw(rest_hours_to_draw, rest_minutes_to_draw)
-            )
+def notify_draw_ending(bot, draw, notifications):
+    reminder_at = draw.end_at - ScheduledNotification.REMIND_BEFORE_END
+    if now() < reminder_at:
+        return {notification.id: reminder_at for notification in notifications}
+    rest_time_to_end_draw = get_rest_time_to_end_draw(draw)
     if not rest_time_to_end_draw:
-        successful_attempts = context.job.context['successful_attempts']
-        message = textwrap.dedent(f'''
-            Спасибо за участие в игре 👏
-            Вы угадали {successful_attempts} из {MAX_PUZZLES_TO_WIN} ребусов''')
-        show_end_message(context.bot, chat_id, message, remove_keyboard=False)
-        context.job.schedule_removal()
-
-
-def send_message_for_start_draw(context):
-    chat_id = context.job.context['chat_id']
-    draws = check_draws(TYPE_COMPETITION['is_rebus'])
-    rest_time_to_draw = get_rest_time_to_draw(draws)
-    if draws and not rest_time_to_draw:
-        context.bot.send_message(
-            chat_id=chat_id,
-            text=f'👌 Розыгрыш рюкзака/сумки начался. Вы можете принять участие.'
-        ) if context.job.context['current_competition'] == TYPE_COMPETITION['is_rebus'] else True
-        context.job.schedule_removal()
+        return {}
+    for notification in notifications:
+        show_rebus_reminder(bot, notification.chat_id, rest_time_to_end_draw)
+    # the reminder is repeated every minute until the draw ends
+    reminder_due = now() + REMINDER_INTERVAL
+    return {notification.id: reminder_due for notification in notifications}
+
+
+def notify_draw_finished(bot, draw, notifications):
+    if now() < draw.end_at:
+        return {notification.id: draw.end_at for notification in notifications}
+    solved_by_chats = dict(DrawProgress.objects.filter(
+        draw=draw, player__telegram_id__in=[notification.chat_id for notification in notifications],
+    ).values_list('player__telegram_id', 'solved'))
+    return {
+        notification.id: show_draw_finished(bot, notification.chat_id, solved_by_chats.get(notification.chat_id, 0))
+        for notification in notifications
+    }
@@ -0,0 +1,124 @@
+import hmac
+import json
+import time
+import logging
+from queue import Queue, Full
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Update
+from telegram.error import Unauthorized
+from telegram.ext import Updater
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateQueue(Queue):
+    # Bounded queue which remembers when every item was put in, so the time an update
+    # spends waiting for a handler is visible in metrics
+    def __init__(self, maxsize=0, name='update_queue'):
+        super().__init__(maxsize)
+        self.name = name
+        metrics.register_gauge(f'{name}.depth', self.qsize)
+
+    def _put(self, item):
+        super()._put((time.monotonic(), item))
+
+    def _get(self):
+        enqueued_at, item = super()._get()
+        metrics.observe(f'{self.name}.wait', time.monotonic() - enqueued_at)
+        return item
+
+
+class WebhookRequestHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+        if not self.server.webhook_path or self.path != self.server.webhook_path:
+            return self.send_json(404)
+        if not self.has_secret_token():
+            metrics.incr('webhook.forbidden')
+            return self.send_json(403)
+        content_length = int(self.headers.get('Content-Length', 0))
+        try:
+            data = json.loads(self.rfile.read(content_length))
+        except ValueError:
+            return self.send_json(400)
+        if not isinstance(data, dict):
+            return self.send_json(400)
+        update = Update.de_json(data, self.server.bot)
+        try:
+            self.server.update_queue.put(update, timeout=self.server.enqueue_timeout)
+        except Full:
+            # Telegram redelivers the update later if the webhook doesn't answer 200
+            metrics.incr('webhook.rejected')
+            return self.send_json(503)
+        metrics.incr('webhook.accepted')
+        self.send_json(200)
+
+    def has_secret_token(self):
+        # Telegram sends the secret given to setWebhook in every request
+        if not self.server.secret_token:
+            return True
+        secret_token = self.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        return hmac.compare_digest(secret_token.encode(), self.server.secret_token.encode())
+
+    def do_GET(self):
+        if self.path != '/metrics':
+            return self.send_json(404)
+        self.send_json(200, metrics.snapshot())
+
+    def send_json(self, status, payload=None):
+        body = json.dumps(payload or {}).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, bot, update_queue, webhook_path=None, secret_token='', enqueue_timeout=1):
+        super().__init__(address, WebhookRequestHandler)
+        self.bot = bot
+        self.update_queue = update_queue
+        self.webhook_path = webhook_path
+        self.secret_token = secret_token
+        self.enqueue_timeout = enqueue_timeout
+
+
+class ListenerUpdater(Updater):
+
+    def start_listener(self, listen, port, webhook_url=None, secret_token=''):
+        # Without webhook_url the listener only serves /metrics next to polling
+        webhook_path = urlsplit(webhook_url).path if webhook_url else None
+        self.httpd = WebhookServer((listen, port), self.bot, self.update_queue, webhook_path, secret_token)
+        self._init_thread(self.httpd.serve_forever, 'listener')
+        if webhook_url:
+            self.running = True
+            self.job_queue.start()
+            self._init_thread(self.dispatcher.start, 'dispatcher')
+            self.set_webhook(webhook_url, secret_token)
+        return self.update_queue
+
+    def set_webhook(self, webhook_url, secret_token):
+        # this version of the library doesn't know secret_token, extra arguments go to the Bot API as they are
+        webhook_kwargs = {'secret_token': secret_token} if secret_token else {}
+
+        def set_webhook():
+            self.bot.set_webhook(url=webhook_url, **webhook_kwargs)
+            return False
+
+        def retry_unless_unauthorized(error):
+            if isinstance(error, Unauthorized):
+                raise error
+            logger.warning('Could not set webhook: %s', error)
+
+        self._network_loop_retry(set_webhook, retry_unless_unauthorized, 'set webhook', 5)
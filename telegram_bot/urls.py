@@ -1,10 +1,11 @@
 from django.urls import path
 from rest_framework.urlpatterns import format_suffix_patterns
-from telegram_bot.views import download_result_polls_in_csv
+from telegram_bot.views import download_poll_results_artifact, download_result_polls_in_csv
 
 
 urlpatterns = [
-    path('poll/file/', download_result_polls_in_csv)
+    path('poll/file/', download_result_polls_in_csv),
+    path('poll/file/<int:artifact_id>/', download_poll_results_artifact),
 ]
 
 urlpatterns = format_suffix_patterns(urlpatterns, allowed=['csv'])
@@ -1,51 +1,99 @@
 import csv
-import tempfile
+from itertools import groupby
+from operator import itemgetter
 
 from django.urls import reverse
-from django.http import HttpResponseRedirect, HttpResponse
+from django.db.models import Max
+from django.http import HttpResponseRedirect
+from django.shortcuts import get_object_or_404, redirect
 
-from .models import PollResult, PollQuestionAnswerPair
+from .exports import Export, export_jobs, get_artifact_response
+from .models import ExportArtifact, Player, PollQuestion, PollQuestionAnswerPair, PollResult
+
+
+EXPORT_CHUNK_SIZE = 2000
+
+
+class Echo:
+    # csv writer returns the written line instead of keeping it
+    def write(self, value):
+        return value
 
 
 def redirect2admin(request):
     return HttpResponseRedirect(reverse('admin:index'))
 
 
-def write_to_file(tmp_file, serialized_polls=[], questions_fields=[]):
-    with open(tmp_file.name, 'w') as poll_file:
-        fields_names = ['Имя и фамилия', 'Номер телефона']
-        poll_writer = csv.DictWriter(
-            poll_file,
-            delimiter=',',
-            quotechar='"',
-            quoting=csv.QUOTE_MINIMAL,
-            fieldnames=fields_names + questions_fields
-        )
-        poll_writer.writeheader()
-        for serialized_poll in serialized_polls:
-            poll_writer.writerow(serialized_poll)
-
-
-def prepare_poll_result_file_for_download(tmp_file):
-    polls = PollResult.objects.filter(poll_finished=True, user__exclude_from_export=False)
-    all_paris_questions_answers = PollQuestionAnswerPair.objects.values('question').distinct()
-    questions_fields = [pair['question'] for pair in all_paris_questions_answers]
-    if not polls:
-        write_to_file(tmp_file)
-        return
-    serialized_polls = [{
-        'Имя и фамилия': poll.user.full_name,
-        'Номер телефона': poll.user.phone_number,
-        **{pair.question: pair.answer for pair in poll.poll_question_answer_pairs.all()},
-    } for poll in polls]
-    write_to_file(tmp_file, serialized_polls, questions_fields)
+def get_exported_polls():
+    return PollResult.objects.filter(poll_finished=True, user__exclude_from_export=False)
+
+
+def iterate_serialized_polls(questions):
+    # one query joins polls, players and answers, rows of a poll come one after another
+    rows = get_exported_polls().order_by('id', 'poll_question_answer_pairs__id').values_list(
+        'id', 'user__full_name', 'user__phone_number',
+        'poll_question_answer_pairs__question', 'poll_question_answer_pairs__answer',
+    ).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+    for _, poll_rows in groupby(rows, key=itemgetter(0)):
+        poll_rows = list(poll_rows)
+        _, full_name, phone_number, _, _ = poll_rows[0]
+        yield {
+            'Имя и фамилия': full_name,
+            'Номер телефона': phone_number,
+            **{questions[question_id]: answer for _, _, _, question_id, answer in poll_rows if question_id},
+        }
+
+
+def iterate_poll_results_csv():
+    questions = dict(PollQuestion.objects.values_list('id', 'text'))
+    questions_fields = list(questions.values())
+    fields_names = ['Имя и фамилия', 'Номер телефона']
+    poll_writer = csv.DictWriter(
+        Echo(),
+        delimiter=',',
+        quotechar='"',
+        quoting=csv.QUOTE_MINIMAL,
+        lineterminator='\n',
+        fieldnames=fields_names + questions_fields
+    )
+    yield poll_writer.writeheader()
+    for serialized_poll in iterate_serialized_polls(questions):
+        yield poll_writer.writerow(serialized_poll)
+
+
+class PollResultsExport(Export):
+    kind = 'poll_results'
+
+    def get_watermark(self):
+        # the latest changes are read from indexes, so it doesn't get slower as polls are added;
+        # answers are written in batches after the poll is finished, players are edited in the admin
+        return ':'.join(str(value) for value in [
+            PollResult.objects.aggregate(value=Max('ended_at'))['value'],
+            PollQuestionAnswerPair.objects.aggregate(value=Max('id'))['value'],
+            Player.objects.aggregate(value=Max('updated_at'))['value'],
+            PollQuestion.objects.aggregate(value=Max('updated_at'))['value'],
+        ])
+
+    def count_rows(self):
+        return get_exported_polls().count()
+
+    def get_filename(self, version):
+        return f'PollResults-{version}.csv'
+
+    def write(self, output, report_progress):
+        lines = iterate_poll_results_csv()
+        output.write(next(lines).encode())
+        for rows_done, line in enumerate(lines, 1):
+            output.write(line.encode())
+            report_progress(rows_done)
 
 
 def download_result_polls_in_csv(request, format=None):
-    tmp_file = tempfile.NamedTemporaryFile(suffix='.csv')
-    prepare_poll_result_file_for_download(tmp_file)
-    with open(tmp_file.name, 'r') as csv_file:
-        output_file_name = 'PollResults.csv'
-        response = HttpResponse(csv_file.read(), content_type='text/csv')
-        response['Content-Disposition'] = f'attachment; filename="{output_file_name}"'
-    return response
+    # the export is built in the background, its page reloads itself until the file is downloaded
+    artifact = export_jobs.request(PollResultsExport())
+    return redirect(download_poll_results_artifact, artifact.id)
+
+
+def download_poll_results_artifact(request, artifact_id):
+    artifact = get_object_or_404(ExportArtifact, pk=artifact_id, kind=PollResultsExport.kind)
+    return get_artifact_response(request, artifact)
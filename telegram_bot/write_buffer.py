@@ -0,0 +1,118 @@
+import time
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, close_old_connections, connection
+
+from . import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    # Rows of append-only logs are kept in memory and inserted with one bulk_create per
+    # model every batch_size rows or flush_interval seconds. Nothing the bot reads back
+    # while talking to a player may go through the buffer: such rows are saved right away.
+    # Until the buffer is started, e.g. in the admin, rows are saved right away too.
+    def __init__(self, batch_size=500, flush_interval=1.0, max_size=100000):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_size = max_size
+        self._rows = defaultdict(list)  # model: unsaved instances
+        self._size = 0
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        metrics.register_gauge('write_buffer.size', lambda: self._size)
+
+    def start(self):
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+        # start_bot stops the buffer on the way out, the thread must not keep a failed process alive
+        self._thread = threading.Thread(target=self.flush_periodically, name='write_buffer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def add(self, row):
+        if not self._running:
+            row.save()
+            return
+        with self._condition:
+            self._rows[type(row)].append(row)
+            self._size += 1
+            if self._size >= self.batch_size:
+                self._condition.notify()
+
+    def flush_periodically(self):
+        while True:
+            with self._condition:
+                if self._running and self._size < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                running = self._running
+            if not running:
+                break
+            close_old_connections()
+            self.flush()
+        connection.close()
+
+    def flush(self):
+        with self._flush_lock:
+            with self._condition:
+                batches, self._rows, self._size = self._rows, defaultdict(list), 0
+            for model, rows in batches.items():
+                self.insert(model, rows)
+
+    def insert(self, model, rows):
+        started_at = time.monotonic()
+        try:
+            model.objects.bulk_create(rows, batch_size=self.batch_size)
+        except IntegrityError:
+            # e.g. a referenced row was deleted meanwhile, keep every row that still fits
+            self.insert_one_by_one(rows)
+        except DatabaseError:
+            logger.exception('Could not write %s %s rows, will retry', len(rows), model.__name__)
+            metrics.incr('write_buffer.failed')
+            self.put_back(model, rows)
+            return
+        metrics.incr(f'write_buffer.{model._meta.model_name}', len(rows))
+        metrics.observe('write_buffer.flush', time.monotonic() - started_at)
+
+    def insert_one_by_one(self, rows):
+        for row in rows:
+            try:
+                row.save()
+            except IntegrityError:
+                logger.exception('Dropped unsaved %s', type(row).__name__)
+                metrics.incr('write_buffer.dropped')
+
+    def put_back(self, model, rows):
+        with self._condition:
+            self._rows[model] = rows + self._rows[model]
+            self._size += len(rows)
+            dropped = min(max(self._size - self.max_size, 0), len(self._rows[model]))
+            if dropped:
+                # the database is down for too long, the oldest rows go first
+                logger.error('Write buffer is full, dropped %s %s rows', dropped, model.__name__)
+                metrics.incr('write_buffer.dropped', dropped)
+                del self._rows[model][:dropped]
+                self._size -= dropped
+
+
+write_buffer = WriteBehindBuffer(
+    batch_size=settings.WRITE_BUFFER_BATCH_SIZE,
+    flush_interval=settings.WRITE_BUFFER_FLUSH_INTERVAL,
+)